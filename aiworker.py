@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Backend de IA residente: en lugar de lanzar ./ask_ai (y con él el intérprete,
+el cliente MCP y la carga de session.json) por cada mensaje, el bot mantiene
+uno o más procesos vivos y les habla por stdin/stdout.
+
+Protocolo (una línea JSON por mensaje, en UTF-8):
+
+    -> {"id": 7, "op": "ask", "chat_id": 123, "text": "hola"}
+    <- {"id": 7, "delta": "¡Ho"}               (opcional, tantas como haga falta)
+    <- {"id": 7, "delta": "la!"}
+    <- {"id": 7, "ok": true, "output": "¡Hola!"}
+    <- {"id": 7, "ok": false, "error": "mensaje"}
+
+Las líneas "delta" llevan la respuesta a medida que se genera (para
+mostrarla en vivo); la línea final con "ok" es la que cuenta. Para cancelar
+un pedido en curso se envía {"id": 7, "op": "cancel"}; el backend debe
+cortarlo y responder igual su línea final (con "ok": false).
+
+Operaciones: "ask", "reset" (resumir y empezar una sesión nueva) y "discard"
+(descartar la sesión). El backend guarda la sesión de cada chat en memoria;
+los chats se reparten fijos entre los procesos (chat_id % tamaño), así que
+cada chat habla siempre con el mismo. Ver bench/stubs/ai_worker.
+"""
+import itertools
+import json
+import logging
+import os
+import queue
+import shlex
+import subprocess
+import threading
+import time
+
+import runner
+
+DEFAULT_TIMEOUT = float(os.getenv("AI_WORKER_TIMEOUT", "300"))
+# Segundos que se espera la respuesta final de un pedido cancelado antes de matar el proceso
+CANCEL_GRACE = 5.0
+
+
+class AIWorkerError(RuntimeError):
+    pass
+
+
+class AIWorkerCancelled(AIWorkerError):
+    pass
+
+
+class AIWorker:
+    """
+    Un proceso backend. Atiende un pedido a la vez; si no responde a tiempo
+    o se muere, se mata y se vuelve a lanzar en el siguiente pedido.
+    """
+
+    def __init__(self, command, cwd=None, stderr_path=None, name="ai-worker"):
+        self.command = command
+        self.cwd = cwd
+        self.stderr_path = stderr_path
+        self.name = name
+        self.restarts = 0
+        self._proc = None
+        self._lines = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _start(self):
+        stderr = open(self.stderr_path, "ab") if self.stderr_path else subprocess.DEVNULL
+        try:
+            proc = subprocess.Popen(
+                shlex.split(self.command), cwd=self.cwd,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr,
+                start_new_session=True,  # para matar también a sus hijos
+            )
+        finally:
+            if stderr is not subprocess.DEVNULL:
+                stderr.close()
+        lines = queue.Queue()
+        threading.Thread(target=self._read, args=(proc, lines), name=f"{self.name}-reader", daemon=True).start()
+        self._proc, self._lines = proc, lines
+        logging.info(f"Started AI worker {self.name} (pid {proc.pid}): {self.command}")
+
+    @staticmethod
+    def _read(proc, lines):
+        for line in proc.stdout:
+            lines.put(line)
+        lines.put(None)  # EOF: el proceso terminó
+
+    def alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def stop(self):
+        with self._lock:
+            self._kill()
+
+    def _kill(self):
+        if self._proc is not None:
+            runner.kill_group(self._proc)
+            self._proc = None
+
+    def request(self, op, chat_id, text="", timeout=DEFAULT_TIMEOUT, on_delta=None, cancel=None):
+        """
+        Envía un pedido y espera su respuesta; on_delta(texto) recibe los
+        fragmentos intermedios. Lanza AIWorkerError si falla y
+        AIWorkerCancelled si se activa el threading.Event cancel. El timeout
+        cuenta desde la última línea recibida.
+        """
+        with self._lock:
+            if not self.alive():
+                if self._proc is not None:
+                    self.restarts += 1
+                    logging.warning(f"AI worker {self.name} exited with {self._proc.returncode}, restarting")
+                self._start()
+            request_id = next(self._ids)
+            try:
+                self._send({"id": request_id, "op": op, "chat_id": chat_id, "text": text})
+                reply = self._reply(request_id, timeout, on_delta, cancel)
+            except AIWorkerCancelled:
+                raise
+            except (OSError, AIWorkerError) as e:
+                # No sabemos en qué estado quedó la conversación con el proceso
+                self._kill()
+                raise AIWorkerError(str(e)) from e
+        if not reply.get("ok"):
+            raise AIWorkerError(reply.get("error", "error desconocido"))
+        return reply.get("output", "")
+
+    def _send(self, data):
+        self._proc.stdin.write(json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n")
+        self._proc.stdin.flush()
+
+    def _reply(self, request_id, timeout, on_delta, cancel):
+        deadline = time.monotonic() + timeout
+        cancelled = False
+        while True:
+            if cancel is not None and cancel.is_set() and not cancelled:
+                cancelled = True
+                self._send({"id": request_id, "op": "cancel"})
+                deadline = time.monotonic() + CANCEL_GRACE
+            remaining = max(deadline - time.monotonic(), 0)
+            try:
+                line = self._lines.get(timeout=min(remaining, 0.2) if cancel is not None else remaining)
+            except queue.Empty:
+                if time.monotonic() < deadline:
+                    continue
+                if cancelled:
+                    self._kill()
+                    raise AIWorkerCancelled("pedido cancelado (el backend no respondió y se reinicia)")
+                raise AIWorkerError(f"sin respuesta del backend de IA tras {timeout:g}s")
+            deadline = time.monotonic() + (CANCEL_GRACE if cancelled else timeout)
+            if line is None:
+                raise AIWorkerError("el backend de IA terminó inesperadamente")
+            try:
+                reply = json.loads(line.decode("utf-8"))
+            except ValueError:
+                logging.warning(f"AI worker {self.name}: ignoring non-JSON line: {line[:200]!r}")
+                continue
+            if reply.get("id") != request_id:
+                logging.warning(f"AI worker {self.name}: ignoring reply for request {reply.get('id')}")
+                continue
+            if "delta" in reply:
+                if on_delta and reply["delta"] and not cancelled:
+                    on_delta(reply["delta"])
+                continue
+            if cancelled:
+                raise AIWorkerCancelled("pedido cancelado")
+            return reply
+
+
+class AIWorkerPool:
+    """size procesos con el mismo comando; cada chat usa siempre el mismo."""
+
+    def __init__(self, command, size=1, cwd=None, stderr_path=None, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.workers = [AIWorker(command, cwd, stderr_path, name=f"ai-worker-{i}") for i in range(max(1, size))]
+
+    def worker(self, chat_id):
+        return self.workers[int(chat_id) % len(self.workers)]
+
+    def ask(self, chat_id, text, on_delta=None, cancel=None):
+        return self.worker(chat_id).request("ask", chat_id, text, self.timeout, on_delta, cancel)
+
+    def reset(self, chat_id):
+        return self.worker(chat_id).request("reset", chat_id, timeout=self.timeout)
+
+    def discard(self, chat_id):
+        return self.worker(chat_id).request("discard", chat_id, timeout=self.timeout)
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Almacén de aliases: predefinidos (builtin_aliases.json, sólo lectura) y de
+usuario.
+
+Los aliases de usuario viven en la base de estado (state.py), que hace de
+journal: cada cambio es una transacción SQLite y lo ven todos los procesos.
+Después de cada cambio se vuelca un snapshot legible a aliases.json de forma
+atómica (archivo temporal + rename), así el archivo nunca queda atrás de la
+base. Si aliases.json o builtin_aliases.json cambian en disco (edición
+externa) se recargan solos; una edición externa de aliases.json reemplaza a
+los aliases de la base.
+"""
+import json
+import logging
+import os
+import threading
+
+
+def atomic_write_json(path, data):
+    """Escribe data en path sin dejar nunca un archivo a medio escribir."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class AliasStore:
+    def __init__(self, state, path="aliases.json", builtin_path="builtin_aliases.json"):
+        self.state = state
+        self.path = path
+        self.builtin_path = builtin_path
+        self.builtin = {}
+        self.user = {}
+        self.version = 0
+        self._builtin_mtime = None
+        self._revision = None
+        self._broken_mtime = None  # mtime de un aliases.json ilegible (no se relee hasta que cambie)
+        self._views = {}  # nombre -> (versión, texto)
+        self._lock = threading.RLock()
+        self.refresh(force=True)
+
+    # --- Carga ---
+
+    def _read_json(self, path, description):
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                return data
+            logging.error(f"Formato de {description} inválido.")
+        except Exception as e:
+            logging.error(f"Error cargando {description}: {str(e)}")
+        return None
+
+    def _import_file(self, mtime):
+        """aliases.json cambió por fuera: pasa a ser el contenido de la base."""
+        data = self._read_json(self.path, "aliases")
+        if data is None:
+            self._broken_mtime = mtime  # archivo roto: conservamos lo que hay en la base
+            return
+        logging.info(f"Importando aliases desde {self.path}")
+        self.state.replace_aliases(data, meta={'aliases_file_mtime': str(mtime)})
+
+    def refresh(self, force=False):
+        """Recarga lo que haya cambiado (archivos o base). Devuelve True si recargó."""
+        with self._lock:
+            changed = False
+            builtin_mtime = _mtime(self.builtin_path)
+            if force or builtin_mtime != self._builtin_mtime:
+                if builtin_mtime is None:
+                    logging.warning(f"No se encontró archivo {self.builtin_path}. Se usará un diccionario vacío.")
+                builtin = self._read_json(self.builtin_path, "aliases inmutables")
+                if builtin is not None:
+                    self.builtin = builtin
+                self._builtin_mtime = builtin_mtime
+                changed = True
+
+            mtime = _mtime(self.path)
+            if (mtime is not None and mtime != self._broken_mtime
+                    and str(mtime) != self.state.get_meta('aliases_file_mtime')):
+                self._import_file(mtime)
+
+            revision = self.state.aliases_revision()
+            if force or revision != self._revision:
+                self.user = self.state.aliases()
+                self._revision = revision
+                changed = True
+
+            if changed:
+                self.version += 1
+            return changed
+
+    # --- Escritura ---
+
+    def _changed(self):
+        # Los cambios son pocos y el snapshot es chico: se escribe siempre, si
+        # no una edición externa posterior borraría los aliases no volcados
+        self.compact()
+        self.refresh()
+
+    def compact(self):
+        """Vuelca los aliases de la base a aliases.json (atómicamente)."""
+        with self._lock:
+            atomic_write_json(self.path, self.state.aliases())
+            self.state.set_meta('aliases_file_mtime', str(_mtime(self.path)))
+    
+    def set(self, name, command):
+        """Crea o actualiza un alias de usuario, conservando su descripción."""
+        with self._lock:
+            self.refresh()  # primero las ediciones externas, para no pisarlas
+            self.state.set_alias(name, command)
+            self._changed()
+
+    def describe(self, name, description):
+        """Cambia la descripción de un alias de usuario. False si no existe."""
+        with self._lock:
+            self.refresh()
+            if not self.state.describe_alias(name, description):
+                return False
+            self._changed()
+            return True
+
+    # --- Lectura ---
+
+    def tables(self):
+        """(versión, [predefinidos, usuario]) para router.AliasResolver."""
+        with self._lock:
+            self.refresh()
+            return self.version, [self.builtin, self.user]
+
+    def view(self, name, render):
+        """
+        Texto derivado de los aliases (menú, listado), memorizado: render(builtin,
+        user) sólo se vuelve a llamar cuando cambia la versión del almacén.
+        """
+        with self._lock:
+            self.refresh()
+            cached = self._views.get(name)
+            if cached and cached[0] == self.version:
+                return cached[1]
+            text = render(self.builtin, self.user)
+            self._views[name] = (self.version, text)
+            return text
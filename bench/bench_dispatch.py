@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark del ruteo de comandos: CommandRouter (índice por primera
+palabra) contra la cadena de startswith que usaba process_message, y costo de
+expandir aliases anidados con y sin memoización.
+
+Uso: python bench/bench_dispatch.py [--commands N] [--iterations N]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from router import AliasResolver, CommandRouter
+
+
+def build_router(n):
+    router = CommandRouter()
+    for i in range(n):
+        router.prefix(f"cmd{i}")(lambda message, args: None)
+        router.exact(f"exact{i}")(lambda message, args: None)
+    return router
+
+
+def linear_match(names, text):
+    text_lower = text.lower().strip()
+    for name in names:
+        if text_lower == name or text_lower.startswith(name + " "):
+            return name
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--commands", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    router = build_router(args.commands)
+    names = [f"cmd{i}" for i in range(args.commands)] + [f"exact{i}" for i in range(args.commands)]
+    # Peor caso para la cadena lineal: el último comando, y un mensaje que no es comando
+    samples = [f"cmd{args.commands - 1} some args", f"exact{args.commands - 1}", "una pregunta para la IA"]
+
+    print(f"{args.commands * 2} comandos, {args.iterations} iteraciones por caso (ns/mensaje)")
+    for text in samples:
+        t_router = timeit.timeit(lambda: router.match(text), number=args.iterations)
+        t_linear = timeit.timeit(lambda: linear_match(names, text), number=args.iterations)
+        print(f"  {text[:28]:<30} router {t_router / args.iterations * 1e9:8.0f}   "
+              f"cadena if/elif {t_linear / args.iterations * 1e9:8.0f}")
+
+    # Aliases anidados: a0 -> a1 -> ... -> a9 -> sys echo
+    table = {f"a{i}": {"command": f"a{i + 1}"} for i in range(9)}
+    table["a9"] = {"command": "sys echo ${*}"}
+    memo = AliasResolver(lambda: (1, [table]))
+    version = [0]
+
+    def no_memo():
+        version[0] += 1  # versión nueva en cada llamada: nunca usa lo memorizado
+        return version[0], [table]
+
+    plain = AliasResolver(no_memo)
+    t_memo = timeit.timeit(lambda: memo.expand("a0 hola"), number=args.iterations)
+    t_plain = timeit.timeit(lambda: plain.expand("a0 hola"), number=args.iterations)
+    print(f"  {'alias anidado x10':<30} memo   {t_memo / args.iterations * 1e9:8.0f}   "
+          f"sin memo      {t_plain / args.iterations * 1e9:8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Latencia de logging.info vista por el hilo que responde: RotatingFileHandler
+sincrónico (como antes) contra logpipeline (cola + hilo escritor, mensajes
+recortados), con respuestas del tamaño de una salida de `sys`.
+
+Uso: python bench/bench_logging.py [--messages N] [--payload BYTES] [--dir DIR]
+"""
+import argparse
+import logging
+import logging.handlers
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import logpipeline
+
+
+def measure(messages, payload):
+    body = ("x" * 79 + "\n") * (payload // 80)
+    times = []
+    for i in range(messages):
+        start = time.perf_counter()
+        logging.info(f"Sending response to {i}: {body}")
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2], times[int(len(times) * 0.99)], sum(times)
+
+
+def report(name, result):
+    p50, p99, total = result
+    print(f"  {name:<28} p50 {p50 * 1e6:8.1f}us   p99 {p99 * 1e6:8.1f}us   total {total * 1e3:8.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--payload", type=int, default=64 * 1024)
+    parser.add_argument("--dir", help="Directorio para los logs (por defecto uno temporal)")
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix="bench_logging_")
+    print(f"{args.messages} mensajes de {args.payload} bytes en {directory}")
+
+    handler = logging.handlers.RotatingFileHandler(os.path.join(directory, "sync.log"), maxBytes=1048576,
+                                                   backupCount=5, encoding="utf-8")
+    handler.setFormatter(logging.Formatter(logpipeline.TEXT_FORMAT))
+    logging.basicConfig(level="INFO", handlers=[handler], force=True)
+    report("RotatingFileHandler", measure(args.messages, args.payload))
+
+    for fmt in ("text", "json"):
+        pipeline = logpipeline.setup(os.path.join(directory, f"queue_{fmt}.log"), fmt=fmt)
+        report(f"logpipeline ({fmt})", measure(args.messages, args.payload))
+        start = time.perf_counter()
+        pipeline.stop()
+        print(f"  {'':<28} vaciado de la cola {(time.perf_counter() - start) * 1e3:.1f}ms, "
+              f"descartados {pipeline.dropped}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Captura de pantalla para `screen`: el camino anterior (import a PNG en disco,
+convert a JPEG y releer el archivo) contra screencap.py (mss + Pillow en
+memoria, o un solo `import` a stdout si faltan).
+
+Con --xvfb se levanta un servidor X virtual del tamaño pedido (p.ej. 3840x2160)
+con un fondo generado, así se puede medir sin pantalla ni tocar la del usuario.
+
+Uso: python bench/bench_screen.py [--xvfb 3840x2160] [--runs N] [--quality Q] [--max-width W]
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import screencap
+
+
+def start_xvfb(size, workdir):
+    """Levanta Xvfb en un display libre con un fondo de ruido (para que el JPEG no sea trivial)."""
+    display = next(f":{n}" for n in range(99, 200) if not os.path.exists(f"/tmp/.X11-unix/X{n}"))
+    proc = subprocess.Popen(["Xvfb", display, "-screen", "0", f"{size}x24", "-nolisten", "tcp"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while not os.path.exists(f"/tmp/.X11-unix/X{display[1:]}"):
+        if proc.poll() is not None or time.monotonic() > deadline:
+            sys.exit("No se pudo iniciar Xvfb.")
+        time.sleep(0.05)
+    os.environ["DISPLAY"] = display
+    if shutil.which("convert") and shutil.which("display"):
+        background = os.path.join(workdir, "background.png")
+        subprocess.run(["convert", "-size", size, "plasma:", background], check=True)
+        subprocess.run(["display", "-window", "root", background], check=True, timeout=60)
+    else:
+        print("  (sin ImageMagick: fondo liso, los JPEG salen más chicos que en una pantalla real)")
+    return proc
+
+
+def capture_disk(workdir, quality):
+    """El camino anterior de cmd_screen."""
+    png = os.path.join(workdir, "screen.png")
+    jpg = os.path.join(workdir, "screen.jpg")
+    subprocess.run(f"import -window root {png} && convert -quality {quality} {png} {jpg}",
+                   shell=True, check=True, timeout=screencap.TIMEOUT)
+    with open(jpg, "rb") as f:
+        return f.read()
+
+
+def measure(name, fn, runs):
+    fn()  # la primera vez conecta con X y carga librerías
+    times = []
+    size = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        size = len(fn())
+        times.append(time.perf_counter() - start)
+    times.sort()
+    print(f"  {name:<26} p50 {times[len(times) // 2] * 1000:8.1f}ms   p95 {times[int(len(times) * 0.95)] * 1000:8.1f}ms"
+          f"   {size / 1024:8.1f} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--xvfb", metavar="WxH", help="Capturar un Xvfb de este tamaño en lugar de $DISPLAY")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--quality", type=int, default=screencap.QUALITY)
+    parser.add_argument("--max-width", type=int, default=screencap.MAX_WIDTH)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_screen_")
+    xvfb = start_xvfb(args.xvfb, workdir) if args.xvfb else None
+    try:
+        if not os.getenv("DISPLAY"):
+            sys.exit("Sin DISPLAY: usar --xvfb WxH o correr dentro de una sesión X.")
+        print(f"DISPLAY={os.environ['DISPLAY']}, {args.runs} capturas, calidad {args.quality}, "
+              f"ancho máximo {args.max_width or 'original'}")
+        if shutil.which("import") and shutil.which("convert"):
+            measure("import + convert (disco)", lambda: capture_disk(workdir, args.quality), args.runs)
+            measure("import a stdout", lambda: screencap.capture_imagemagick(
+                max_width=args.max_width, quality=args.quality).getvalue(), args.runs)
+            measure("import a stdout, sin achicar", lambda: screencap.capture_imagemagick(
+                max_width=0, quality=args.quality).getvalue(), args.runs)
+        else:
+            print("  (sin ImageMagick: no se mide el camino anterior)")
+        if screencap.mss is not None:
+            measure("mss + Pillow", lambda: screencap.capture(
+                max_width=args.max_width, quality=args.quality).getvalue(), args.runs)
+            measure("mss + Pillow, sin achicar", lambda: screencap.capture(
+                max_width=0, quality=args.quality).getvalue(), args.runs)
+        else:
+            print("  (sin mss/Pillow: pip install mss pillow)")
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Servidor local que imita lo que usan bot.py y botsend.py de la Bot API de
+Telegram: getUpdates (long polling), sendMessage, editMessageText,
+sendVoice/sendDocument/sendPhoto/sendAudio, getFile y la descarga de
+archivos. Sirve para medir sin tocar Telegram (ver bench/loadtest.py).
+
+Los updates se inyectan con push_text()/push_voice(): si el bot registró un
+webhook (setWebhook) se le envían por POST con el secret token, como hace
+Telegram; si no, esperan al próximo getUpdates. Cada llamada del bot se
+registra en `calls` y se pasa a on_call(call), donde la prueba de carga
+decide cuándo terminó de atenderse un mensaje.
+
+Uso suelto: python bench/fake_telegram.py [--port 8081]
+y en el bot TELEGRAM_API_URL=http://127.0.0.1:8081
+"""
+import argparse
+import email
+import itertools
+import json
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# Unos bytes con cabecera Ogg: al bot sólo le importa poder descargarlos
+DEFAULT_VOICE = b"OggS" + bytes(4092)
+
+
+class Call:
+    def __init__(self, method, params, uploaded):
+        self.time = time.monotonic()
+        self.method = method
+        self.params = params
+        self.uploaded = uploaded  # nombres de los campos que vinieron como archivo
+        try:
+            self.chat_id = int(params.get("chat_id"))
+        except (TypeError, ValueError):
+            self.chat_id = None
+
+    @property
+    def text(self):
+        return self.params.get("text") or self.params.get("caption") or ""
+
+
+class FakeTelegram(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), voice_bytes=DEFAULT_VOICE, on_call=None):
+        super().__init__(address, FakeTelegramHandler)
+        self.voice_bytes = voice_bytes
+        self.on_call = on_call
+        self.calls = []
+        self.updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self.webhook = None  # (url, secret_token) registrado con setWebhook
+        self.ready = threading.Event()  # el bot ya hizo getUpdates o setWebhook
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_error(self, request, client_address):
+        # El bot cierra conexiones al terminar: no es un error del servidor
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-telegram", daemon=True).start()
+        return self
+
+    # --- Updates entrantes ---
+
+    def _message(self, chat_id, **content):
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "bench", "username": f"bench{chat_id}"},
+            **content,
+        }
+
+    def push(self, message):
+        with self._cond:
+            update = {"update_id": next(self._update_ids), "message": message}
+            webhook = self.webhook
+            if webhook is None:
+                self.updates.append(update)
+                self._cond.notify_all()
+        if webhook is not None:
+            self.post_update(update, *webhook)
+        return update["update_id"]
+
+    def post_update(self, update, url, secret_token):
+        request = urllib.request.Request(url, data=json.dumps(update).encode("utf-8"), headers={
+            "Content-Type": "application/json",
+            "X-Telegram-Bot-Api-Secret-Token": secret_token,
+        })
+        urllib.request.urlopen(request, timeout=10).close()
+
+    def push_text(self, chat_id, text):
+        return self.push(self._message(chat_id, text=text))
+
+    def push_voice(self, chat_id, duration=2):
+        file_id = f"voice-{next(self._file_ids)}"
+        return self.push(self._message(chat_id, voice={
+            "file_id": file_id, "file_unique_id": file_id, "duration": duration,
+            "mime_type": "audio/ogg", "file_size": len(self.voice_bytes),
+        }))
+
+    def get_updates(self, offset, timeout, limit=100):
+        self.ready.set()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                pending = [u for u in self.updates if u["update_id"] >= offset][:limit]
+                remaining = deadline - time.monotonic()
+                if pending or remaining <= 0:
+                    # Lo confirmado (offset) ya no hace falta guardarlo
+                    self.updates = [u for u in self.updates if u["update_id"] >= offset]
+                    return pending
+                self._cond.wait(remaining)
+
+    # --- Llamadas del bot ---
+
+    def record(self, call):
+        with self._cond:
+            self.calls.append(call)
+        if self.on_call:
+            self.on_call(call)
+
+    def sent_message(self, call, **content):
+        message = self._message(call.chat_id or 0, **content)
+        message["from"] = {"id": 1, "is_bot": True, "first_name": "bot", "username": "bench_bot"}
+        return message
+
+    def media(self, call, field):
+        """file_id nuevo si se subió el archivo, o el mismo si se reenvió uno conocido."""
+        if field in call.uploaded:
+            file_id = f"{field}-{next(self._file_ids)}"
+        else:
+            file_id = call.params.get(field)
+        return {"file_id": file_id, "file_unique_id": file_id}
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, result, ok=True, status=200, description=None):
+        data = {"ok": ok, "result": result} if ok else {"ok": False, "error_code": status, "description": description}
+        self._reply(status, json.dumps(data).encode("utf-8"))
+
+    def _params(self):
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+        uploaded = set()
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        content_type = self.headers.get("Content-Type", "")
+        if body and content_type.startswith("multipart/form-data"):
+            message = email.message_from_bytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+            for part in message.get_payload():
+                name = part.get_param("name", header="content-disposition")
+                if part.get_filename() is not None:
+                    uploaded.add(name)
+                    params[name] = part.get_payload(decode=True)
+                else:
+                    params[name] = part.get_payload(decode=True).decode("utf-8")
+        elif body and content_type.startswith("application/x-www-form-urlencoded"):
+            params.update(parse_qsl(body.decode("utf-8")))
+        elif body and content_type.startswith("application/json"):
+            params.update(json.loads(body))
+        return url.path, params, uploaded
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def handle_request(self):
+        server = self.server
+        path, params, uploaded = self._params()
+        if path.startswith("/file/bot"):
+            self._reply(200, server.voice_bytes, "application/octet-stream")
+            return
+        if not path.startswith("/bot") or path.count("/") != 2:
+            self._json(None, ok=False, status=404, description="Not Found")
+            return
+        method = path.rsplit("/", 1)[1]
+
+        if method == "getUpdates":
+            updates = server.get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0),
+                                         int(params.get("limit") or 100))
+            self._json(updates)
+            return
+
+        call = Call(method, params, uploaded)
+        server.record(call)
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bot", "username": "bench_bot"}
+        elif method == "setWebhook":
+            # Sin url es como deleteWebhook (así lo hace telebot en remove_webhook)
+            if params.get("url"):
+                server.webhook = (params["url"], params.get("secret_token", ""))
+                server.ready.set()
+            else:
+                server.webhook = None
+            result = True
+        elif method == "deleteWebhook":
+            server.webhook = None
+            result = True
+        elif method == "getFile":
+            file_id = params.get("file_id")
+            result = {"file_id": file_id, "file_unique_id": file_id,
+                      "file_size": len(server.voice_bytes), "file_path": f"voice/{file_id}.oga"}
+        elif method in ("sendMessage", "editMessageText"):
+            result = server.sent_message(call, text=params.get("text", ""))
+        elif method == "sendVoice":
+            result = server.sent_message(call, voice={**server.media(call, "voice"), "duration": 1})
+        elif method == "sendAudio":
+            result = server.sent_message(call, audio={**server.media(call, "audio"), "duration": 1})
+        elif method == "sendDocument":
+            result = server.sent_message(call, document=server.media(call, "document"))
+        elif method == "sendPhoto":
+            result = server.sent_message(call, photo=[{**server.media(call, "photo"), "width": 1, "height": 1}])
+        else:
+            result = True
+        self._json(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor falso de la Bot API de Telegram.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    def show(call):
+        print(f"{call.method} chat={call.chat_id} {call.text[:60]!r}", flush=True)
+
+    server = FakeTelegram((args.host, args.port), on_call=show)
+    print(f"Bot API falsa en {server.url} (Ctrl+C para salir)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
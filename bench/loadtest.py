@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de bot.py y botsend.py contra la Bot API falsa
+(bench/fake_telegram.py), con ask_ai, transcribe, espeak y botsay de prueba
+(bench/stubs) y demoras configurables. Nada sale a Telegram.
+
+  bot:     levanta bot.py, inyecta N chats x M mensajes (mezcla de texto a
+           la IA, `sys` y notas de voz) y mide mensajes por segundo,
+           percentiles de latencia por tipo de mensaje y memoria del bot.
+  botsend: registra N chats con sesión y ejecuta botsend.py K veces con una
+           nota de voz (reparto a todos los chats), midiendo duración,
+           subidas vs file_ids reutilizados y memoria.
+
+Uso:
+  python bench/loadtest.py bot [--chats N] [--messages M] [--mix ai,sys,voice] [--workers W] [--webhook]
+                               [--ai-worker N]
+  python bench/loadtest.py botsend [--chats N] [--runs K] [--no-cache]
+"""
+import argparse
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO)
+
+from fake_telegram import FakeTelegram, DEFAULT_VOICE
+
+API_KEY = "123456:bench"
+PASSWORD = "bench"
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    if not samples:
+        return float("nan")
+    return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+def rss_kb(pid):
+    """Memoria residente actual de pid (Linux), en KB."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def prepare_workdir(args):
+    """Directorio de trabajo del bot: ayuda, aliases, stubs y una nota de voz."""
+    workdir = tempfile.mkdtemp(prefix="telegrambot_bench_")
+    for name in ("help", "builtin_aliases.json"):
+        if os.path.exists(os.path.join(REPO, name)):
+            shutil.copy(os.path.join(REPO, name), workdir)
+    for name in ("ask_ai", "transcribe", "botsay"):
+        os.symlink(os.path.join(BENCH_DIR, "stubs", name), os.path.join(workdir, name))
+    voice_file = os.path.join(workdir, "voice.ogg")
+    with open(voice_file, "wb") as f:
+        f.write(DEFAULT_VOICE)
+
+    env = dict(os.environ)
+    env.update({
+        "API_KEY": API_KEY,
+        "PASSWORD": PASSWORD,
+        "STATE_DB": os.path.join(workdir, "state.db"),
+        "LOG_FILE": os.path.join(workdir, "bot.log"),
+        "TRANSCRIBE_SOCKET": os.path.join(workdir, "no-server.sock"),  # usa el ./transcribe de prueba
+        "TOSPEECH_ENGINES": "espeak",
+        "TOSPEECH_CACHE_DIR": os.path.join(workdir, "tts-cache"),
+        "PATH": os.path.join(BENCH_DIR, "stubs") + os.pathsep + env.get("PATH", ""),
+        "BENCH_REPO": REPO,
+        "BENCH_VOICE_FILE": voice_file,
+        "BENCH_AI_DELAY": str(args.ai_delay),
+        "BENCH_AI_STARTUP": str(args.ai_startup),
+        "BENCH_TRANSCRIBE_DELAY": str(args.transcribe_delay),
+        "BENCH_TTS_DELAY": str(args.tts_delay),
+    })
+    return workdir, env, voice_file
+
+
+class Tracker:
+    """
+    Empareja las llamadas del bot con los mensajes inyectados. Cada llamada
+    "final" completa el mensaje pendiente más viejo de ese chat y de ese tipo
+    (la IA corre fuera de la cola del chat, así que los tipos no terminan en
+    orden). Una respuesta de la IA completa tantos mensajes como preguntas
+    junte (coalesce.py).
+    """
+
+    def __init__(self, stream_commands=True):
+        self.pending = defaultdict(deque)  # chat_id -> deque[(tipo, t0)]
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.outstanding = 0
+        self.last_done = None
+        self.cond = threading.Condition()
+        self.done = {
+            "login": lambda call: call.method == "sendMessage" and call.text == "Authorized",
+            # Las respuestas de los stubs terminan en ")": así se distingue la edición final
+            # de las parciales cuando la respuesta llega en vivo
+            "ai": (lambda call: call.method in ("sendMessage", "editMessageText")
+                   and call.text.startswith("AI:") and call.text.endswith(")")),
+            # Un comando rápido sale en un solo sendMessage; uno lento termina con una edición
+            "sys": (lambda call: call.method in ("sendMessage", "editMessageText") and " exit " in call.text)
+            if stream_commands
+            else (lambda call: call.method == "sendMessage" and "bench" in call.text),
+            "voice": lambda call: call.method == "sendVoice",
+            "stats": lambda call: call.method == "sendMessage" and call.text.startswith("Métricas"),
+        }
+
+    def expect(self, chat_id, kind):
+        with self.cond:
+            self.pending[chat_id].append((kind, time.monotonic()))
+            self.outstanding += 1
+
+    def on_call(self, call):
+        with self.cond:
+            queue = self.pending.get(call.chat_id)
+            if not queue:
+                return
+            failed = call.method == "sendMessage" and call.text.startswith("Error")
+            if failed:
+                kind = queue[0][0]
+                self.errors[kind] += 1
+                count = 1
+            else:
+                kind = next((kind for kind, _ in queue if self.done[kind](call)), None)
+                if kind is None:
+                    return
+                count = max(1, call.text.count("pregunta ")) if kind == "ai" else 1
+            for entry in [entry for entry in queue if entry[0] == kind][:count]:
+                queue.remove(entry)
+                self.latencies[kind].append(call.time - entry[1])
+                self.outstanding -= 1
+            self.last_done = call.time
+            self.cond.notify_all()
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.outstanding:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+
+def bench_bot(args):
+    workdir, env, _ = prepare_workdir(args)
+    tracker = Tracker(stream_commands=not args.no_stream)
+    server = FakeTelegram(on_call=tracker.on_call).start()
+    env.update({
+        "TELEGRAM_API_URL": server.url,
+        "DISPATCH_WORKERS": str(args.workers),
+        "STREAM_COMMANDS": "0" if args.no_stream else "1",
+        "STREAM_AI": "0" if args.no_stream else "1",
+        "LIVE_EDIT_INTERVAL": str(args.live_interval),
+    })
+    if args.ai_worker:
+        env["AI_WORKER_COMMAND"] = os.path.join(BENCH_DIR, "stubs", "ai_worker")
+        env["AI_WORKERS"] = str(args.ai_worker)
+    if args.webhook:
+        port = free_port()
+        env.update({
+            "BOT_MODE": "webhook",
+            "WEBHOOK_PORT": str(port),
+            "WEBHOOK_SECRET": "bench-secret",
+            "WEBHOOK_URL": f"http://127.0.0.1:{port}",
+        })
+    print(f"Bot API falsa en {server.url}, directorio de trabajo {workdir}")
+    with open(os.path.join(workdir, "bot.stdout"), "w") as out:
+        proc = subprocess.Popen([sys.executable, os.path.join(REPO, "bot.py")], cwd=workdir, env=env,
+                                stdout=out, stderr=subprocess.STDOUT)
+    peak = [0]
+    stop = threading.Event()
+
+    def sample_memory():
+        while not stop.is_set():
+            peak[0] = max(peak[0], rss_kb(proc.pid))
+            stop.wait(0.2)
+
+    threading.Thread(target=sample_memory, daemon=True).start()
+    try:
+        if not server.ready.wait(30):
+            sys.exit(f"bot.py no empezó a recibir updates; ver {workdir}/bot.stdout")
+        chats = list(range(1001, 1001 + args.chats))
+        for chat_id in chats:
+            tracker.expect(chat_id, "login")
+            server.push_text(chat_id, f"login {PASSWORD}")
+        if not tracker.wait(args.timeout):
+            sys.exit("Los logins no terminaron a tiempo.")
+        tracker.latencies.clear()
+        idle_rss = rss_kb(proc.pid)
+
+        mix = args.mix.split(",")
+        interval = 1 / args.rate if args.rate else 0
+        start = time.monotonic()
+        for i in range(args.messages):
+            for n, chat_id in enumerate(chats):
+                kind = mix[(i + n) % len(mix)]
+                tracker.expect(chat_id, kind)
+                if kind == "voice":
+                    server.push_voice(chat_id)
+                elif kind == "sys":
+                    server.push_text(chat_id, f"sys echo bench {i}")
+                else:
+                    server.push_text(chat_id, f"pregunta {i} del chat {chat_id}")
+                if interval:
+                    time.sleep(interval)
+        finished = tracker.wait(args.timeout)
+        elapsed = (tracker.last_done or time.monotonic()) - start
+
+        total = sum(len(v) for v in tracker.latencies.values())
+        mode = "webhook" if args.webhook else "polling"
+        if args.ai_worker:
+            mode += f", {args.ai_worker} AI workers"
+        print(f"\n{args.chats} chats x {args.messages} mensajes ({args.mix}), {args.workers} workers, {mode}"
+              + ("" if finished else f" -- TIEMPO AGOTADO, {tracker.outstanding} sin respuesta"))
+        print(f"  {total} mensajes en {elapsed:.2f}s: {total / elapsed:.1f} mensajes/s")
+        for kind, samples in sorted(tracker.latencies.items()):
+            print(f"  {kind:<6} n={len(samples):<5} p50 {percentile(samples, 0.5) * 1000:8.1f}ms  "
+                  f"p95 {percentile(samples, 0.95) * 1000:8.1f}ms  p99 {percentile(samples, 0.99) * 1000:8.1f}ms  "
+                  f"errores {tracker.errors[kind]}")
+        calls = Counter(call.method for call in server.calls)
+        print("  llamadas a la API: " + ", ".join(f"{m}={c}" for m, c in sorted(calls.items())))
+        print(f"  memoria del bot: {idle_rss / 1024:.1f} MB en reposo, pico {peak[0] / 1024:.1f} MB")
+
+        # Desglose por etapa según el propio bot
+        tracker.expect(chats[0], "stats")
+        server.push_text(chats[0], "stats")
+        if tracker.wait(10):
+            stats = [c for c in server.calls if c.text.startswith("Métricas")][-1]
+            print("\n" + stats.text)
+    finally:
+        stop.set()
+        proc.terminate()
+        proc.wait()
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_botsend(args):
+    import state
+
+    workdir, env, voice_file = prepare_workdir(args)
+    server = FakeTelegram().start()
+    env["TELEGRAM_API_URL"] = server.url
+    store = state.StateStore(env["STATE_DB"])
+    for chat_id in range(1001, 1001 + args.chats):
+        store.authorize(chat_id)
+
+    command = [sys.executable, os.path.join(REPO, "botsend.py"), "--voice", voice_file, "--message", "hola"]
+    if args.no_cache:
+        command.append("--no-cache")
+    durations = []
+    try:
+        for _ in range(args.runs):
+            start = time.monotonic()
+            subprocess.run(command, cwd=workdir, env=env, check=True)
+            durations.append(time.monotonic() - start)
+        voices = [c for c in server.calls if c.method == "sendVoice"]
+        uploads = sum(1 for c in voices if "voice" in c.uploaded)
+        max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        print(f"botsend.py x{args.runs} a {args.chats} chats" + (" (sin cache)" if args.no_cache else ""))
+        print(f"  por ejecución: p50 {percentile(durations, 0.5) * 1000:.0f}ms  "
+              f"p95 {percentile(durations, 0.95) * 1000:.0f}ms  max {max(durations) * 1000:.0f}ms")
+        print(f"  sendVoice: {len(voices)} ({uploads} subidas, {len(voices) - uploads} con file_id)")
+        print(f"  sendMessage: {sum(1 for c in server.calls if c.method == 'sendMessage')}")
+        print(f"  memoria máxima de botsend.py: {max_rss / 1024:.1f} MB")
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("target", choices=["bot", "botsend"])
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=20, help="Mensajes por chat (bot)")
+    parser.add_argument("--mix", default="ai,sys,voice", help="Tipos de mensaje a alternar: ai, sys, voice")
+    parser.add_argument("--workers", type=int, default=4, help="DISPATCH_WORKERS del bot")
+    parser.add_argument("--rate", type=float, default=0, help="Mensajes por segundo a inyectar (0 = todos de una)")
+    parser.add_argument("--runs", type=int, default=10, help="Ejecuciones de botsend.py")
+    parser.add_argument("--no-cache", action="store_true", help="botsend.py sin reutilizar file_ids")
+    parser.add_argument("--webhook", action="store_true", help="Bot en modo webhook (BOT_MODE=webhook)")
+    parser.add_argument("--no-stream", action="store_true", help="STREAM_COMMANDS=0 y STREAM_AI=0 en el bot")
+    parser.add_argument("--live-interval", type=float, default=1.5, help="LIVE_EDIT_INTERVAL del bot")
+    parser.add_argument("--ai-worker", type=int, default=0, metavar="N",
+                        help="Usar N backends de IA residentes (stubs/ai_worker) en vez de ./ask_ai")
+    parser.add_argument("--ai-delay", type=float, default=0.2)
+    parser.add_argument("--ai-startup", type=float, default=0, help="Arranque simulado del backend de IA")
+    parser.add_argument("--transcribe-delay", type=float, default=0.5)
+    parser.add_argument("--tts-delay", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--keep", action="store_true", help="No borrar el directorio de trabajo")
+    args = parser.parse_args()
+
+    if args.target == "bot":
+        bench_bot(args)
+    else:
+        bench_botsend(args)
+
+
+if __name__ == "__main__":
+    main()
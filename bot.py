@@ -1,16 +1,40 @@
 #!/usr/bin/python3
 
 import os
-import json
+import importlib
 from dotenv import load_dotenv
+
+# Antes de importar los módulos del bot: leen su configuración (RUN_*,
+# STATE_DB, TOSPEECH_*, CAMERA_*...) del entorno al importarse
+load_dotenv()
+
 import telebot
+from telebot import apihelper
 import requests
 import os
 import subprocess
+import tempfile
+import threading
+import time
 import logging
-from logging.handlers import RotatingFileHandler
-
-load_dotenv()
+import logpipeline
+import dispatcher
+from livemessage import LiveMessage
+from jobs import JobManager
+from output import OutputDelivery
+import runner
+import aiworker
+from coalesce import ChatCoalescer
+from metrics import Metrics
+import state
+from router import CommandRouter, AliasResolver, AliasCycleError
+from aliasstore import AliasStore
+import transcribe
+import tospeech
+import screencap
+import camera
+import botsend
+import webhook
 
 # --- Logging configuration ---
 LOG_FILE = os.getenv("LOG_FILE", "bot.log")
@@ -22,171 +46,337 @@ log_dir = os.path.dirname(LOG_FILE)
 if log_dir and not os.path.exists(log_dir):
     os.makedirs(log_dir)
 
-# Configure rotating file handler
-handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
-formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-handler.setFormatter(formatter)
+# Tamaño máximo (bytes) de cada mensaje de log; el resto se resume
+LOG_MAX_PAYLOAD = int(os.getenv("LOG_MAX_PAYLOAD", "2048"))
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # text | json
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
 
-# Apply configuration to root logger
-logging.basicConfig(level=LOG_LEVEL, handlers=[handler], force=True)
+# Los handlers sólo encolan; un hilo aparte escribe (y rota) el archivo
+log_pipeline = logpipeline.setup(LOG_FILE, level=LOG_LEVEL, max_bytes=LOG_MAX_BYTES,
+                                 backup_count=LOG_BACKUP_COUNT, max_payload=LOG_MAX_PAYLOAD,
+                                 fmt=LOG_FORMAT, queue_size=LOG_QUEUE_SIZE)
 # --- End of logging configuration ---
 
 API_KEY = str(os.getenv('API_KEY'))
-PASSWORD = str(os.getenv('PASSWORD'))
-SUDO_PASSWORD = str(os.getenv('SUDO_PASSWORD'))
-DISPLAY = str(os.getenv('DISPLAY'))
-DBUS = str(os.getenv('DBUS_SESSION_BUS_ADDRESS'))
-VOICE_ES = str(os.getenv('VOICE_ES', 'es'))
-VOICE_EN = str(os.getenv('VOICE_EN', 'en'))
-authorized = []
+# Hilos para atender chats en paralelo (los mensajes de un mismo chat siguen en orden)
+DISPATCH_WORKERS = int(os.getenv('DISPATCH_WORKERS', '4'))
+# Archivo .prom para el textfile collector de node_exporter (vacío = no se escribe)
+METRICS_TEXTFILE = os.getenv('METRICS_TEXTFILE', '')
+METRICS_WRITE_INTERVAL = float(os.getenv('METRICS_WRITE_INTERVAL', '15'))
+# Cómo llegan los updates: polling (getUpdates) o webhook (servidor HTTP local)
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# URL pública por la que Telegram llega al webhook (vacío = setWebhook se hace por fuera)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    # Sin secreto no se puede validar quién llama al webhook; fallar acá haría que
+    # el script telegrambot reinicie el bot cada segundo, así que seguimos con polling
+    logging.error("BOT_MODE=webhook requires WEBHOOK_SECRET; falling back to polling")
+    BOT_MODE = "polling"
+# Backend de IA residente (protocolo JSON-lines de aiworker.py); vacío = ./ask_ai por mensaje
+AI_WORKER_COMMAND = os.getenv('AI_WORKER_COMMAND', '')
+AI_WORKERS = int(os.getenv('AI_WORKERS', '1'))
+AI_WORKER_CWD = os.path.expanduser(os.getenv('AI_WORKER_CWD', '')) or None
+# stderr de los procesos de IA (por defecto junto al log del bot)
+AI_WORKER_STDERR = os.path.expanduser(os.getenv('AI_WORKER_STDERR', '')) or os.path.join(log_dir, "ai_worker.err")
+# Cámara para `photo`: opencv (abierta y con los últimos cuadros en memoria, ver camera.py),
+# fake (pruebas) o vacío (streamer en cada pedido)
+CAMERA_SOURCE = os.getenv('CAMERA_SOURCE', '').lower()
+# Updates que llegan con más de estos segundos (p.ej. acumulados durante un
+# reinicio) se descartan o se combinan según el comando (ver stale_update_policy)
+STALE_UPDATE_SECONDS = float(os.getenv('STALE_UPDATE_SECONDS', '120'))
+
+
+def load_config():
+    """
+    Lee la configuración que se puede cambiar sin reiniciar (ver reload_bot).
+    API_KEY, el modo polling/webhook, los workers y el logging sólo se leen al arrancar.
+    """
+    global PASSWORD, SUDO_PASSWORD, DISPLAY, DBUS, VOICE_ES, VOICE_EN, TRANSCRIBE_SOCKET
+    global VOICE_MAX_BYTES, VOICE_TRANSCODE, STREAM_COMMANDS, STREAM_AI, LIVE_EDIT_INTERVAL, LIVE_FIRST_DELAY
+    global JOB_OUTPUT_BYTES, OUTPUT_DOCUMENT_THRESHOLD, TRANSCRIBE_TIMEOUT, SESSION_TTL
+    global AI_COALESCE_WINDOW, AI_COALESCE_MAX_WAIT, AI_COALESCE_POLICY
+    PASSWORD = str(os.getenv('PASSWORD'))
+    SUDO_PASSWORD = str(os.getenv('SUDO_PASSWORD'))
+    DISPLAY = str(os.getenv('DISPLAY'))
+    DBUS = str(os.getenv('DBUS_SESSION_BUS_ADDRESS'))
+    VOICE_ES = str(os.getenv('VOICE_ES', 'es'))
+    VOICE_EN = str(os.getenv('VOICE_EN', 'en'))
+    # Socket del servidor residente de transcripción (./transcribe --serve)
+    TRANSCRIBE_SOCKET = os.getenv('TRANSCRIBE_SOCKET', transcribe.DEFAULT_SOCKET)
+    # Tamaño máximo de nota de voz a descargar (la Bot API no sirve archivos de más de 20 MB)
+    VOICE_MAX_BYTES = int(os.getenv('VOICE_MAX_BYTES', str(20 * 1024 * 1024)))
+    # Whisper decodifica el Opus de Telegram con ffmpeg: re-codificar a Vorbis es opcional
+    VOICE_TRANSCODE = os.getenv('VOICE_TRANSCODE', '0') == '1'
+    # Mostrar la salida de sys/ssys/sudo a medida que llega, editando un mensaje (0/1)
+    STREAM_COMMANDS = os.getenv('STREAM_COMMANDS', '1') == '1'
+    # Mostrar las respuestas de la IA a medida que se generan (0/1)
+    STREAM_AI = os.getenv('STREAM_AI', '1') == '1'
+    # Segundos mínimos entre ediciones del mensaje en vivo
+    LIVE_EDIT_INTERVAL = float(os.getenv('LIVE_EDIT_INTERVAL', '1.5'))
+    # Segundos que espera el primer envío de un comando: si termina antes, sale un solo mensaje
+    LIVE_FIRST_DELAY = float(os.getenv('LIVE_FIRST_DELAY', '0.5'))
+    # Bytes de salida que se conservan por cada trabajo en segundo plano
+    JOB_OUTPUT_BYTES = int(os.getenv('JOB_OUTPUT_BYTES', '65536'))
+    # Salidas de más de estos caracteres se envían como .txt.gz (y se recorren con "more")
+    OUTPUT_DOCUMENT_THRESHOLD = int(os.getenv('OUTPUT_DOCUMENT_THRESHOLD', '12000'))
+    # Tiempo máximo del ./transcribe de respaldo (carga el modelo en cada llamada)
+    TRANSCRIBE_TIMEOUT = float(os.getenv('TRANSCRIBE_TIMEOUT', '900'))
+    # Segundos que dura un login (0 = hasta el logout)
+    SESSION_TTL = float(os.getenv('SESSION_TTL', '0'))
+    # Mensajes para la IA que llegan con un pedido en curso, o con menos de
+    # AI_COALESCE_WINDOW segundos entre sí, se juntan en un solo pedido
+    AI_COALESCE_WINDOW = float(os.getenv('AI_COALESCE_WINDOW', '0'))
+    AI_COALESCE_MAX_WAIT = float(os.getenv('AI_COALESCE_MAX_WAIT', '5'))
+    # wait: se juntan para el pedido siguiente; cancel: se cancela el pedido en curso y se repite con todo
+    AI_COALESCE_POLICY = os.getenv('AI_COALESCE_POLICY', 'wait').lower()
+
+
+load_config()
 
 # Prohibimos alias con estos nombres (creados por el usuario)
 PROHIBITED_ALIAS_NAMES = {
     "alias", "describe", "exit", "quit", "logout",
     "reset", "restart", "sys", "sudo",
-    "load_aliases", "help", "menu"
+    "load_aliases", "help", "menu",
+    "jobs", "job", "kill", "more", "stats"
 }
 
-# Diccionario global de aliases predefinidos (sólo lectura)
-builtin_aliases = {}
+# Aliases predefinidos (builtin_aliases.json, sólo lectura) y de usuario
+# (base de estado + snapshot en aliases.json); se recargan solos si cambian en disco
+ALIAS_FILE = "aliases.json"
 BUILTIN_ALIAS_FILE = "builtin_aliases.json"
 
-# Diccionario global de aliases creados por el usuario
-aliases = {}
-ALIAS_FILE = "aliases.json"  # Almacenar en JSON
+if botsend.TELEGRAM_API_URL:
+    botsend.use_api_server(botsend.TELEGRAM_API_URL)
 
-bot = telebot.TeleBot(API_KEY)
+# threaded=False: el reparto en hilos lo hace dispatcher.ChatDispatcher
+bot = telebot.TeleBot(API_KEY, threaded=False)
 
+def notify_job_exit(job):
+    status = "✅" if job.returncode == 0 else "❌"
+    response_text = f"{status} Job {job.id} terminó (exit {job.returncode}, {job.elapsed:.0f}s): {job.command}"
+    tail = job.output.tail(2000).strip()
+    if tail:
+        response_text += "\n\n" + tail
+    logging.info(f"Sending response to {job.chat_id}: {response_text}")
+    bot.send_message(job.chat_id, response_text)
 
-def load_builtin_aliases():
-    """Carga los aliases inmutables desde el archivo builtin_aliases.json (si existe)."""
-    global builtin_aliases
-    if not os.path.exists(BUILTIN_ALIAS_FILE):
-        logging.warning(f"No se encontró archivo {BUILTIN_ALIAS_FILE}. Se usará un diccionario vacío.")
-        builtin_aliases = {}
-        return
-    try:
-        with open(BUILTIN_ALIAS_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            if isinstance(data, dict):
-                builtin_aliases = data
-            else:
-                logging.error("Formato de aliases inmutables inválido.")
-    except Exception as e:
-        logging.error(f"Error cargando aliases inmutables: {str(e)}")
-        builtin_aliases = {}
+# Latencia de cada etapa (comando `stats` y textfile de Prometheus)
+metrics = Metrics(textfile=METRICS_TEXTFILE or None, write_interval=METRICS_WRITE_INTERVAL)
+# Registros de log descartados con la cola llena (ver logpipeline.py)
+metrics.counter("log_records_dropped", lambda: log_pipeline.dropped)
 
+# Entrega de salidas largas en varios mensajes o como documento
+output = OutputDelivery(bot, document_threshold=OUTPUT_DOCUMENT_THRESHOLD)
 
-def load_aliases():
-    global aliases
-    if not os.path.exists(ALIAS_FILE):
-        aliases = {}
-        return
-    try:
-        with open(ALIAS_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            if isinstance(data, dict):
-                aliases = data
-            else:
-                logging.error("Formato de alias inválido en JSON.")
-    except Exception as e:
-        logging.error(f"Error cargando aliases: {str(e)}")
+# Trabajos lanzados con `sys <comando> &`
+jobs = JobManager(max_output_bytes=JOB_OUTPUT_BYTES, on_exit=notify_job_exit)
 
+# Sesiones, aliases de usuario y caches, compartidos con botsend.py y tospeech.py
+state_store = state.StateStore()
 
-def save_aliases():
-    try:
-        with open(ALIAS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(aliases, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logging.error(f"Error guardando aliases: {str(e)}")
+# file_ids de notas de voz ya subidas (compartido con botsend.py)
+file_id_cache = botsend.FileIdCache(state_store)
 
-def ask_ai(chat_id, query):
-    try:
-        cmd = f"TELEGRAM_BOT_USER_ID=\"{chat_id}\" TELEGRAM_BOT_CHAT_ID=\"{chat_id}\" ./ask_ai \"{query}\""
-        logging.info(f"Executing command: {cmd}")
-        response = os.popen(cmd + " 2>&1").read()
-        return response
-    except Exception as e:
-        logging.error(f"Error asking AI: {str(e)}")
-        return f"Lo siento, ha ocurrido un error: {str(e)}."
 
-def apply_aliases(message_text):
-    """
-    - Primero busca el comando en `builtin_aliases` (read-only),
-      si no lo encuentra, busca en `aliases` (editables).
-    - Si se encuentra un alias, reemplaza `?` por los argumentos.
-    """
-    tokens = message_text.strip().split()
-    if not tokens:
-        return message_text
-
-    command = tokens[0]
-    args = tokens[1:]
-
-    # 1) ¿Está en los aliases predefinidos inmutables?
-    if command.lower() in builtin_aliases:
-        alias_replacement = builtin_aliases[command.lower()].get('command', '')
-    # 2) Si no, ¿está en los aliases creados por el usuario?
-    elif command.lower() in aliases:
-        alias_replacement = aliases[command.lower()].get('command', '')
-    else:
-        # No es alias, se devuelve tal cual
-        return message_text
+alias_store = AliasStore(state_store, ALIAS_FILE, BUILTIN_ALIAS_FILE)
 
-    # Reemplazar '${*}'
-    if '${*}' in alias_replacement:
-        final_command = alias_replacement.replace('${*}', ' '.join(args))
-    else:
-        final_command = alias_replacement
-        if args:
-            final_command += ' ' + ' '.join(args)
-    return final_command.strip()
+# Expansión de aliases: primero los predefinidos, después los del usuario
+alias_resolver = AliasResolver(alias_store.tables)
 
+# Procesos de IA residentes (se lanzan con el primer pedido)
+ai_workers = aiworker.AIWorkerPool(AI_WORKER_COMMAND, AI_WORKERS, cwd=AI_WORKER_CWD,
+                                   stderr_path=AI_WORKER_STDERR) if AI_WORKER_COMMAND else None
 
-@bot.message_handler(commands=['menu','help'])
-def menu(message):
-    if message.chat.id in authorized:
-        help_content = ""
-        if os.path.exists("help"):
-            with open("help", "r", encoding="utf-8") as hf:
-                help_content = hf.read()
+# Un solo pedido a la sesión de IA de cada chat a la vez: las respuestas de
+# ai_queue, las de los audios y reset/forget usan la misma sesión
+_ai_session_locks = {}
+_ai_session_locks_guard = threading.Lock()
 
-        # En este nuevo modelo, mostramos todos los aliases como "comandos"
-        # sin incluir el comando real, únicamente su nombre y su descripción.
-        # 1) primero los predefinidos
-        if builtin_aliases:
-            for alias_name, alias_data in builtin_aliases.items():
-                desc = alias_data.get('description', '')
-                help_content += f"- *{alias_name}*    "
-                if desc:
-                    help_content += f"  {desc}\n"
-
-        # 2) luego los del usuario
-        if aliases:
-            help_content += "\n**Comandos definidos por el usuario:**\n"
-            for alias_name, alias_data in aliases.items():
-                desc = alias_data.get('description', '')
-                help_content += f"- *{alias_name}*    "
-                if desc:
-                    help_content += f"  {desc}\n"
+def ai_session_lock(chat_id):
+    with _ai_session_locks_guard:
+        return _ai_session_locks.setdefault(chat_id, threading.Lock())
 
-        if not help_content:
-            help_content = "No hay ayuda disponible."
-        logging.info(f"Sending response to {message.chat.id}: {help_content}")
-        bot.reply_to(message, help_content, parse_mode="Markdown")
-    else:
-        logging.info(f"Sending response to {message.chat.id}: Just say hi")
-        bot.reply_to(message, "Just say hi")
+def ask_ai(chat_id, query, on_output=None, cancel=None):
+    """
+    Respuesta de la IA a query; on_output(texto) recibe la respuesta a medida
+    que se genera. Si se activa cancel (threading.Event) el pedido se corta y
+    la respuesta no sirve. Espera a que termine cualquier otro pedido del chat.
+    """
+    with ai_session_lock(chat_id):
+        if ai_workers is not None:
+            try:
+                with metrics.timer("ai.ask"):
+                    return ai_workers.ask(chat_id, query, on_delta=on_output, cancel=cancel)
+            except aiworker.AIWorkerCancelled:
+                return ""
+            except OSError as e:
+                # No se pudo lanzar el proceso (no existe, sin permiso de ejecución...)
+                logging.warning(f"AI worker not available ({str(e)}), falling back to ./ask_ai")
+            except aiworker.AIWorkerError as e:
+                logging.error(f"Error asking AI: {str(e)}")
+                return f"Lo siento, ha ocurrido un error: {str(e)}."
+        try:
+            cmd = f"TELEGRAM_BOT_USER_ID=\"{chat_id}\" TELEGRAM_BOT_CHAT_ID=\"{chat_id}\" ./ask_ai \"{query}\""
+            logging.info(f"Executing command: {cmd}")
+            with metrics.timer("ai.ask"):
+                return runner.run(cmd, on_output=on_output, cancel=cancel).text(empty="")
+        except Exception as e:
+            logging.error(f"Error asking AI: {str(e)}")
+            return f"Lo siento, ha ocurrido un error: {str(e)}."
 
+def transcribe_audio(chat_id, audio_path):
+    """
+    Transcribe usando el servidor residente (modelo ya cargado). Si no está
+    corriendo, cae al script ./transcribe, que carga el modelo en cada llamada.
+    """
+    try:
+        return transcribe.transcribe_remote(audio_path, socket_path=TRANSCRIBE_SOCKET)
+    except (FileNotFoundError, ConnectionRefusedError) as e:
+        logging.warning(f"Transcription server not available ({str(e)}), falling back to ./transcribe")
+    cmd = f"TELEGRAM_BOT_CHAT_ID={chat_id} ./transcribe {audio_path}"
+    logging.info(f"Executing command: {cmd}")
+    return runner.run(cmd, timeout=TRANSCRIBE_TIMEOUT).text(empty="")
+
+def send_voice_reply(chat_id, text):
+    """
+    Equivalente en proceso a ./botsay: sintetiza con tospeech y envía el texto
+    y la nota de voz por la conexión del bot, sin lanzar intérpretes nuevos.
+    """
+    with metrics.timer("voice.synthesize"):
+        audio_path = tospeech.synthesize(text)
+    if not audio_path:
+        logging.warning("In-process speech synthesis failed, falling back to ./botsay")
+        cmd = f"TELEGRAM_BOT_CHAT_ID={chat_id} ./botsay \"{text}\""
+        logging.info(f"Executing command: {cmd}")
+        with metrics.timer("voice.botsay"):
+            return runner.run(cmd).output
+    logging.info(f"Sending voice to {chat_id}: {text}")
+    with metrics.timer("voice.send"):
+        output.deliver(chat_id, text, name="ask_ai")  # paginado o como documento si es largo
+        botsend.send_file(bot, "voice", audio_path, [chat_id], file_id_cache)
+
+def run_sudo(cmd):
+    """Ejecuta cmd con sudo; la contraseña va por stdin, no en la línea de comandos."""
+    return runner.run("sudo -S -p '' " + cmd, input=SUDO_PASSWORD + "\n")
+
+def run_live_command(message, cmd, silent=False, input=None):
+    """
+    Ejecuta cmd mostrando la salida a medida que llega en un mensaje que se va
+    editando, y al terminar agrega el código de salida y la duración. Con
+    silent (ssys) no se envía nada si el comando no imprime nada.
+    """
+    this_chat_id = message.chat.id
+    live = LiveMessage(bot, this_chat_id, reply_to=message, min_interval=LIVE_EDIT_INTERVAL,
+                       first_delay=LIVE_FIRST_DELAY)
+    result = runner.run(cmd, input=input, on_output=live.append)
+    response = result.output
+    if silent and not response.strip():
+        live.finish()
+        return
+    if not response.strip():
+        live.append("Done.")
+    status = "✅" if result.returncode == 0 else "❌"
+    footer = f"{status} exit {result.returncode} · {result.elapsed:.1f}s"
+    if result.notes():
+        footer = result.notes() + "\n" + footer
+    live.finish(footer)
+    logging.info(f"Sending response to {this_chat_id}: {response}")
+    if len(response) > live.max_chars:
+        # El mensaje en vivo sólo muestra el final: mandamos también la salida completa
+        output.send_document(this_chat_id, response, reply_to=message)
+
+def stream_ai_reply(chat_id, query, cancel=None):
+    """
+    ask_ai mostrando la respuesta a medida que llega: un placeholder que se
+    va editando y, si la respuesta no entra en un mensaje, sigue en otros.
+    Devuelve False si el pedido se canceló.
+    """
+    start = time.monotonic()
+    live = LiveMessage(bot, chat_id, min_interval=LIVE_EDIT_INTERVAL, overflow="split", placeholder="…")
 
-@bot.message_handler(commands=['aliases'])
-def list_aliases(message):
-    if message.chat.id not in authorized:
-        logging.info(f"Sending response to {message.chat.id}: No estás autorizado.")
-        bot.reply_to(message, "No estás autorizado.")
+    def on_output(text):
+        if not live.text:
+            metrics.observe("ai.first_output", time.monotonic() - start)
+        live.append(text)
+
+    try:
+        response = ask_ai(chat_id, query, on_output=on_output, cancel=cancel)
+    except Exception as e:
+        # El mensaje en vivo se cierra igual: sin esto quedaría el "…" y su hilo de ediciones
+        logging.exception(f"Error asking AI: {str(e)}")
+        live.set_text(f"Lo siento, ha ocurrido un error: {str(e)}.")
+        live.finish()
         return
+    if cancel is not None and cancel.is_set():
+        live.set_text("⏹ Cancelado: respondo junto con los mensajes nuevos." if live.text else "")
+        live.finish()
+        return False
+    logging.info(f"Sending response to {chat_id}: {response}")
+    with metrics.timer("telegram.deliver"):
+        # La respuesta final manda (puede traer avisos que no pasaron por on_output)
+        live.set_text(response)
+        live.finish()
+
+
+def answer_ai_messages(chat_id, messages, cancel):
+    """
+    Handler de ai_queue: responde con un solo pedido a la IA a los mensajes
+    del chat que se juntaron. Devuelve False si el pedido se canceló.
+    """
+    query = "\n".join(message.text for message in messages)
+    with metrics.timer("ai.reply"):
+        if STREAM_AI:
+            return stream_ai_reply(chat_id, query, cancel)
+        response = ask_ai(chat_id, query, cancel=cancel)
+        if cancel.is_set():
+            return False
+        logging.info(f"Sending response to {chat_id}: {response}")
+        with metrics.timer("telegram.deliver"):
+            output.deliver(chat_id, response, name="ask_ai")
+
+
+# Webcam abierta bajo demanda (se cierra tras CAMERA_KEEP_ALIVE segundos sin uso; 0 = siempre abierta)
+if CAMERA_SOURCE == "opencv":
+    webcam = camera.CameraService(camera.OpenCVSource())
+elif CAMERA_SOURCE == "fake":
+    webcam = camera.CameraService(camera.FakeSource())
+else:
+    webcam = None
+if webcam is not None and not webcam.keep_alive:
+    webcam.start()
+
+# Pedidos a la IA por chat, juntando los mensajes que llegan seguidos
+ai_queue = ChatCoalescer(answer_ai_messages, window=AI_COALESCE_WINDOW, max_wait=AI_COALESCE_MAX_WAIT,
+                         policy=AI_COALESCE_POLICY, max_workers=DISPATCH_WORKERS)
+
+def render_menu_aliases(builtin_aliases, aliases):
+    # Mostramos todos los aliases como "comandos" sin incluir el comando
+    # real, únicamente su nombre y su descripción.
+    text = ""
+    # 1) primero los predefinidos
+    for alias_name, alias_data in builtin_aliases.items():
+        desc = alias_data.get('description', '')
+        text += f"- *{alias_name}*    "
+        if desc:
+            text += f"  {desc}\n"
+
+    # 2) luego los del usuario
+    if aliases:
+        text += "\n**Comandos definidos por el usuario:**\n"
+        for alias_name, alias_data in aliases.items():
+            desc = alias_data.get('description', '')
+            text += f"- *{alias_name}*    "
+            if desc:
+                text += f"  {desc}\n"
+    return text
+
 
-    # Construimos la respuesta
+def render_alias_list(builtin_aliases, aliases):
     builtin_text = ""
     user_text = ""
 
@@ -216,314 +406,478 @@ def list_aliases(message):
     else:
         user_text = "No hay aliases de usuario.\n"
 
-    final_msg = builtin_text + "\n" + user_text
+    return builtin_text + "\n" + user_text
+
+
+@bot.message_handler(commands=['menu','help'])
+def menu(message):
+    if state_store.is_authorized(message.chat.id):
+        help_content = ""
+        if os.path.exists("help"):
+            with open("help", "r", encoding="utf-8") as hf:
+                help_content = hf.read()
+
+        help_content += alias_store.view("menu", render_menu_aliases)
+
+        if not help_content:
+            help_content = "No hay ayuda disponible."
+        logging.info(f"Sending response to {message.chat.id}: {help_content}")
+        bot.reply_to(message, help_content, parse_mode="Markdown")
+    else:
+        logging.info(f"Sending response to {message.chat.id}: Just say hi")
+        bot.reply_to(message, "Just say hi")
+
+
+@bot.message_handler(commands=['aliases'])
+def list_aliases(message):
+    if not state_store.is_authorized(message.chat.id):
+        logging.info(f"Sending response to {message.chat.id}: No estás autorizado.")
+        bot.reply_to(message, "No estás autorizado.")
+        return
+
+    final_msg = alias_store.view("aliases", render_alias_list)
     logging.info(f"Sending response to {message.chat.id}: {final_msg}")
     bot.reply_to(message, final_msg, parse_mode="Markdown")
 
 
-@bot.message_handler()
-def process_message(message):
-    logging.info(f"Received text message from {message.from_user.id} ({message.from_user.username}): {message.text}")
+# Comandos de sesión y de manejo de aliases: se evalúan sobre el texto tal
+# cual llega (antes de expandir aliases); auth=False los habilita sin login.
+session_commands = CommandRouter()
+# Comandos de usuarios autorizados, evaluados después de expandir aliases
+commands = CommandRouter()
+
+
+@session_commands.exact("help", "ayuda", "menu", auth=False)
+def cmd_help(message, args):
+    menu(message)
+
+
+@session_commands.exact("hi", auth=False)
+def cmd_hi(message, args):
+    this_chat_id = message.chat.id
+    if state_store.is_authorized(this_chat_id):
+        username = runner.run("whoami").output
+        response_text = "Hi " + username
+        logging.info(f"Sending response to {this_chat_id}: {response_text}")
+        bot.send_message(this_chat_id, response_text)
+    else:
+        response_text = "Hi there"
+        logging.info(f"Sending response to {this_chat_id}: {response_text}")
+        bot.send_message(this_chat_id, response_text)
+
+
+@session_commands.prefix("id", "login", auth=False)
+def cmd_login(message, args):
+    # Verificamos en crudo contra la password
+    if args != PASSWORD:
+        return False
     this_chat_id = message.chat.id
+    state_store.authorize(this_chat_id, SESSION_TTL)
+    response_text = "Authorized"
+    logging.info(f"Sending response to {this_chat_id}: {response_text}")
+    bot.send_message(this_chat_id, response_text)
+
+
+@session_commands.exact("exit", "quit", "logout", auth=False)
+def cmd_logout(message, args):
+    this_chat_id = message.chat.id
+    if state_store.revoke(this_chat_id):
+        response_text = "Logged out."
+        logging.info(f"Sending response to {this_chat_id}: {response_text}")
+        bot.reply_to(message, response_text)
+    else:
+        response_text = "No estás autorizado."
+        logging.info(f"Sending response to {this_chat_id}: {response_text}")
+        bot.reply_to(message, response_text)
+
+
+# Módulos que se recargan con `restart` (los handlers de bot.py los usan por
+# nombre de módulo, así que toman el código nuevo en el siguiente mensaje)
+RELOADABLE_MODULES = (runner, transcribe, tospeech, screencap)
+
+
+def reload_bot():
+    """
+    Recarga .env, la configuración de load_config(), los módulos de
+    RELOADABLE_MODULES y los aliases, sin cortar el polling ni perder las colas.
+    """
+    load_dotenv(override=True)
+    load_config()
+    for module in RELOADABLE_MODULES:
+        importlib.reload(module)
+    output.document_threshold = OUTPUT_DOCUMENT_THRESHOLD
+    jobs.max_output_bytes = JOB_OUTPUT_BYTES
+    ai_queue.window, ai_queue.max_wait, ai_queue.policy = AI_COALESCE_WINDOW, AI_COALESCE_MAX_WAIT, AI_COALESCE_POLICY
+    alias_store.refresh(force=True)
+
+
+@session_commands.exact("restart", auth=False)
+def cmd_restart(message, args):
     try:
-        if not message.text:
-            return
+        reload_bot()
+        response_text = "Bot reloaded."
+    except Exception as e:
+        logging.exception(f"Error reloading bot: {e}")
+        response_text = f"Error reloading bot: {str(e)}. Use 'restart full' to restart the process."
+    logging.info(f"Sending response to {message.chat.id}: {response_text}")
+    bot.reply_to(message, response_text)
+
+
+@session_commands.exact("restart full", auth=False)
+def cmd_restart_full(message, args):
+    response_text = "Restarting bot."
+    logging.info(f"Sending response to {message.chat.id}: {response_text}")
+    bot.reply_to(message, response_text)
+    if ai_workers is not None:
+        ai_workers.stop()
+    if BOT_MODE == "webhook":
+        webhook.stop()
+    else:
+        bot.stop_polling()
 
-        # Forzamos el texto a minúscula para chequear los startswith:
-        text_lower = message.text.lower().strip()
 
-        # Ayuda
-        if text_lower in ["help", "ayuda", "menu"]:
-            menu(message)
-            return
+@session_commands.exact("reset", auth=False)
+def cmd_reset(message, args):
+    this_chat_id = message.chat.id
+    response_text = "Saving session summary and starting a new session."
+    logging.info(f"Sending response to {this_chat_id}: {response_text}")
+    bot.reply_to(message, response_text)
+    # Después del pedido en curso del chat, no en medio
+    with ai_session_lock(this_chat_id):
+        if ai_workers is not None:
+            try:
+                ai_workers.reset(this_chat_id)
+                return
+            except (OSError, aiworker.AIWorkerError) as e:
+                logging.error(f"Error resetting AI session: {str(e)}, falling back to ./ask_ai_reset")
+        cmd = f"TELEGRAM_BOT_USER_ID=\"{this_chat_id}\" TELEGRAM_BOT_CHAT_ID=\"{this_chat_id}\" ./ask_ai_reset"
+        logging.info(f"Executing command: {cmd}")
+        runner.run(cmd)
 
-        # Manejo básico de autenticación y sesión
-        if text_lower == "hi":
-            if this_chat_id in authorized:
-                username = os.popen("whoami 2>&1").read()
-                response_text = "Hi " + username
-                logging.info(f"Sending response to {this_chat_id}: {response_text}")
-                bot.send_message(this_chat_id, response_text)
-            else:
-                response_text = "Hi there"
-                logging.info(f"Sending response to {this_chat_id}: {response_text}")
-                bot.send_message(this_chat_id, response_text)
-            return
 
-        elif text_lower.startswith("id ") or text_lower.startswith("login "):
-            # Verificamos en crudo contra la password
-            # (Podemos ignorar mayúsculas/minúsculas o no, depende de la preferencia)
-            if remove_prefix(message.text, "id ") == PASSWORD or remove_prefix(message.text, "login ") == PASSWORD:
-                authorized.append(this_chat_id)
-                persist_chat_ids()
-                response_text = "Authorized"
-                logging.info(f"Sending response to {this_chat_id}: {response_text}")
-                bot.send_message(this_chat_id, response_text)
+@session_commands.exact("forget", "discard", auth=False)
+def cmd_forget(message, args):
+    this_chat_id = message.chat.id
+    response_text = "Session discarded. New session started."
+    logging.info(f"Sending response to {this_chat_id}: {response_text}")
+    bot.reply_to(message, response_text)
+    # Después del pedido en curso del chat, no en medio
+    with ai_session_lock(this_chat_id):
+        if ai_workers is not None:
+            try:
+                ai_workers.discard(this_chat_id)
                 return
+            except (OSError, aiworker.AIWorkerError) as e:
+                logging.error(f"Error discarding AI session: {str(e)}, falling back to ./ask_ai_discard")
+        cmd = f"TELEGRAM_BOT_USER_ID=\"{this_chat_id}\" TELEGRAM_BOT_CHAT_ID=\"{this_chat_id}\" ./ask_ai_discard"
+        logging.info(f"Executing command: {cmd}")
+        runner.run(cmd)
 
-        elif text_lower in ["exit", "quit", "logout"]:
-            if this_chat_id in authorized:
-                authorized.remove(this_chat_id)
-                persist_chat_ids()
-                response_text = "Logged out."
-                logging.info(f"Sending response to {this_chat_id}: {response_text}")
-                bot.reply_to(message, response_text)
-            else:
-                response_text = "No estás autorizado."
-                logging.info(f"Sending response to {this_chat_id}: {response_text}")
-                bot.reply_to(message, response_text)
-            return
 
-        elif text_lower in ["restart"]:
-            authorized.clear()
-            response_text = "Restarting bot."
-            logging.info(f"Sending response to {this_chat_id}: {response_text}")
-            bot.reply_to(message, response_text)
-            bot.stop_polling()
+@session_commands.exact("aliases")
+def cmd_aliases(message, args):
+    list_aliases(message)  # ¡Llamamos a la misma función!
+
+
+# Crear/actualizar alias
+@session_commands.prefix("alias")
+def cmd_alias(message, args):
+    # parts en crudo
+    parts = args.strip().split(None, 1)
+    # Nota: parted a 2, aunque sea
+    if len(parts) < 2:
+        response_text = "Uso: alias <nombre> <comando con o sin '?'>"
+        logging.info(f"Sending response to {message.chat.id}: {response_text}")
+        bot.reply_to(message, response_text)
+        return
+    alias_name = parts[0].strip()
+    alias_command = parts[1].strip()
+
+    # Validamos si alias_name está en la lista prohibida
+    if alias_name.lower() in PROHIBITED_ALIAS_NAMES:
+        response_text = f"No se permite crear un alias con el nombre '{alias_name}'"
+        logging.info(f"Sending response to {message.chat.id}: {response_text}")
+        bot.reply_to(message, response_text)
+        return
+
+    # Si ya existe, se conserva la descripción
+    alias_store.set(alias_name.lower(), alias_command)
+    response_text = f"Alias '{alias_name}' registrado/actualizado."
+    logging.info(f"Sending response to {message.chat.id}: {response_text}")
+    bot.reply_to(message, response_text)
+
+
+# Describir alias existente
+@session_commands.prefix("describe alias")
+def cmd_describe_alias(message, args):
+    parts = args.strip().split(None, 1)
+    if len(parts) < 2:
+        response_text = "Uso: describe alias <nombre> <descripcion>"
+        logging.info(f"Sending response to {message.chat.id}: {response_text}")
+        bot.reply_to(message, response_text)
+        return
+    alias_name = parts[0].strip().lower()
+    alias_desc = parts[1].strip()
+    if not alias_store.describe(alias_name, alias_desc):
+        response_text = f"El alias '{alias_name}' no existe."
+        logging.info(f"Sending response to {message.chat.id}: {response_text}")
+        bot.reply_to(message, response_text)
+        return
+    response_text = f"Descripción del alias '{alias_name}' actualizada."
+    logging.info(f"Sending response to {message.chat.id}: {response_text}")
+    bot.reply_to(message, response_text)
+
+
+@session_commands.exact("load_aliases")
+def cmd_load_aliases(message, args):
+    # Los cambios en disco se detectan solos; esto fuerza la relectura
+    alias_store.refresh(force=True)
+    response_text = "Aliases cargados desde archivo."
+    logging.info(f"Sending response to {message.chat.id}: {response_text}")
+    bot.reply_to(message, response_text)
+
+
+# Bloque para sys <comando> (y sys <comando> & en segundo plano)
+@commands.prefix("sys")
+def cmd_sys(message, args):
+    this_chat_id = message.chat.id
+    if args.rstrip().endswith("&") and not args.rstrip().endswith("&&"):
+        command = args.rstrip()[:-1].strip()
+        job = jobs.start(this_chat_id, command, f"TELEGRAM_BOT_CHAT_ID={this_chat_id} " + command)
+        response_text = f"Job {job.id} iniciado: {command}"
+        logging.info(f"Sending response to {this_chat_id}: {response_text}")
+        bot.reply_to(message, response_text)
+        return
+    cmd = f"TELEGRAM_BOT_CHAT_ID={this_chat_id} " + args
+    if STREAM_COMMANDS:
+        run_live_command(message, cmd)
+        return
+    response = runner.run(cmd).text()
+    logging.info(f"Sending response to {this_chat_id}: {response}")
+    output.deliver(this_chat_id, response, reply_to=message)
+
+
+@commands.exact("more")
+def cmd_more(message, args):
+    output.more(message.chat.id)
+
+
+@commands.exact("jobs")
+def cmd_jobs(message, args):
+    this_chat_id = message.chat.id
+    chat_jobs = jobs.list(this_chat_id)
+    response_text = "\n".join(j.describe() for j in chat_jobs) if chat_jobs else "No hay trabajos."
+    logging.info(f"Sending response to {this_chat_id}: {response_text}")
+    bot.reply_to(message, response_text)
+
+
+def find_job(message, args):
+    job_id = args.strip()
+    job = jobs.get(int(job_id)) if job_id.isdigit() else None
+    if job is None or job.chat_id != message.chat.id:
+        response_text = f"No existe el job '{job_id}'."
+        logging.info(f"Sending response to {message.chat.id}: {response_text}")
+        bot.reply_to(message, response_text)
+        return None
+    return job
+
+
+@commands.prefix("job")
+def cmd_job(message, args):
+    job = find_job(message, args)
+    if job:
+        response_text = job.describe() + "\n\n" + (job.output.tail(3500).strip() or "(sin salida)")
+        logging.info(f"Sending response to {message.chat.id}: {response_text}")
+        bot.reply_to(message, response_text)
+
+
+@commands.prefix("kill")
+def cmd_kill(message, args):
+    job = find_job(message, args)
+    if job:
+        response_text = f"Job {job.id} terminado." if jobs.kill(job.id) else f"El job {job.id} ya no está corriendo."
+        logging.info(f"Sending response to {message.chat.id}: {response_text}")
+        bot.reply_to(message, response_text)
+
+
+@commands.prefix("ssys")
+def cmd_ssys(message, args):
+    this_chat_id = message.chat.id
+    cmd = f"TELEGRAM_BOT_CHAT_ID={this_chat_id} " + args
+    if STREAM_COMMANDS:
+        run_live_command(message, cmd, silent=True)
+        return
+    response = runner.run(cmd).text(empty="")
+    if response:
+        logging.info(f"Sending response to {this_chat_id}: {response}")
+        output.deliver(this_chat_id, response, reply_to=message)
+
+
+def require_sudo_password(message):
+    if SUDO_PASSWORD is None:
+        response_text = "SUDO_PASSWORD is not set."
+        logging.info(f"Sending response to {message.chat.id}: {response_text}")
+        bot.reply_to(message, response_text)
+        return False
+    return True
+
+
+@commands.prefix("sudo")
+def cmd_sudo(message, args):
+    this_chat_id = message.chat.id
+    if not require_sudo_password(message):
+        return
+    cmd = f"TELEGRAM_BOT_CHAT_ID={this_chat_id} " + args
+    if STREAM_COMMANDS:
+        run_live_command(message, "sudo -S -p '' " + cmd, input=SUDO_PASSWORD + "\n")
+        return
+    response = run_sudo(cmd).text()
+    logging.info(f"Sending response to {this_chat_id}: {response}")
+    output.deliver(this_chat_id, response, reply_to=message)
+
+
+# Comandos de sistema que se ejecutan con sudo
+SUDO_COMMANDS = {
+    "reboot": "shutdown -r now",
+    "shutdown": "shutdown now",
+    "lock": "loginctl lock-sessions",
+    "unlock": "loginctl unlock-sessions",
+}
+
+
+def sudo_command(command):
+    def handler(message, args):
+        if not require_sudo_password(message):
             return
+        response = run_sudo(command).text()
+        logging.info(f"Sending response to {message.chat.id}: {response}")
+        output.deliver(message.chat.id, response, reply_to=message)
+    return handler
 
-        elif text_lower in ["reset"]:
-            response_text = "Saving session summary and starting a new session."
-            logging.info(f"Sending response to {this_chat_id}: {response_text}")
-            bot.reply_to(message, response_text)
-            cmd = f"TELEGRAM_BOT_USER_ID=\"{this_chat_id}\" TELEGRAM_BOT_CHAT_ID=\"{this_chat_id}\" ./ask_ai_reset"
-            logging.info(f"Executing command: {cmd}")
-            response = os.popen(cmd + " 2>&1").read()
+
+for name, command in SUDO_COMMANDS.items():
+    handler = sudo_command(command)
+    handler.__name__ = f"cmd_{name}"  # nombre de la etapa en `stats`
+    commands.exact(name)(handler)
+
+
+@commands.exact("stats")
+def cmd_stats(message, args):
+    response_text = metrics.summary()
+    logging.info(f"Sending response to {message.chat.id}: {response_text}")
+    bot.reply_to(message, response_text)
+
+
+@commands.prefix("notify")
+def cmd_notify(message, args):
+    if DBUS == "None":
+        response_text = "DBUS_SESSION_BUS_ADDRESS is not set."
+        logging.info(f"Sending response to {message.chat.id}: {response_text}")
+        bot.reply_to(message, response_text)
+    else:
+        response = runner.run('notify-send "'+args+'"').text()
+        logging.info(f"Sending response to {message.chat.id}: {response}")
+        output.deliver(message.chat.id, response, reply_to=message)
+
+
+@commands.exact("picture", "photo", "foto")
+def cmd_photo(message, args):
+    this_chat_id = message.chat.id
+    if webcam is not None:
+        try:
+            with metrics.timer("photo.capture"):
+                photo = webcam.photo()
+            logging.info(f"Sending photo to {this_chat_id} ({len(photo.getvalue())} bytes)")
+            bot.send_photo(this_chat_id, photo)
             return
+        except camera.CameraError as e:
+            logging.warning(f"Camera service failed ({str(e)}), falling back to streamer")
+    try:
+        runner.run('rm data/foto0*.jpeg')
+        runner.run('export DISPLAY=:0.0;streamer -t 4 -r 2 -o data/foto00.jpeg', timeout=30)
+        with open("data/foto03.jpeg", "rb") as photo:
+            logging.info(f"Sending photo to {this_chat_id}")
+            bot.send_photo(this_chat_id, photo)
+    except Exception as e:
+        response_text = str(e)
+        logging.info(f"Sending response to {message.chat.id}: {response_text}")
+        bot.reply_to(message, response_text)
+
 
-        elif text_lower in ["forget", "discard"]:
-            response_text = "Session discarded. New session started."
-            logging.info(f"Sending response to {this_chat_id}: {response_text}")
+@commands.exact("screen", "screenshot", "pantalla", "captura")
+def cmd_screen(message, args):
+    this_chat_id = message.chat.id
+    try:
+        if DISPLAY == "None":
+            response_text = "DISPLAY is not set."
+            logging.info(f"Sending response to {message.chat.id}: {response_text}")
             bot.reply_to(message, response_text)
-            cmd = f"TELEGRAM_BOT_USER_ID=\"{this_chat_id}\" TELEGRAM_BOT_CHAT_ID=\"{this_chat_id}\" ./ask_ai_discard"
-            logging.info(f"Executing command: {cmd}")
-            response = os.popen(cmd + " 2>&1").read()
             return
+        runner.run('xhost +local:')
+        # Capturamos y codificamos en memoria (sin PNG ni JPEG en disco)
+        with metrics.timer("screen.capture"):
+            screen = screencap.capture(DISPLAY)
+        logging.info(f"Sending photo to {this_chat_id} ({len(screen.getvalue())} bytes)")
+        with metrics.timer("screen.send"):
+            bot.send_photo(this_chat_id, screen)
+    except Exception as e:
+        response_text = str(e)
+        logging.info(f"Sending response to {message.chat.id}: {response_text}")
+        bot.reply_to(message, response_text)
 
-        # Aquí sólo entran usuarios autorizados
-        if this_chat_id in authorized:
-            if text_lower in ["aliases"]:
-                list_aliases(message)  # ¡Llamamos a la misma función!
-                return
-            # Crear/actualizar alias
-            if text_lower.startswith("alias "):
-                # parts en crudo
-                parts = remove_prefix(message.text, "alias ").strip().split(None, 1)
-                # Nota: parted a 2, aunque sea
-                if len(parts) < 2:
-                    response_text = "Uso: alias <nombre> <comando con o sin '?'>"
-                    logging.info(f"Sending response to {message.chat.id}: {response_text}")
-                    bot.reply_to(message, response_text)
-                    return
-                alias_name = parts[0].strip()
-                alias_command = parts[1].strip()
-
-                # Validamos si alias_name está en la lista prohibida
-                if alias_name.lower() in PROHIBITED_ALIAS_NAMES:
-                    response_text = f"No se permite crear un alias con el nombre '{alias_name}'"
-                    logging.info(f"Sending response to {message.chat.id}: {response_text}")
-                    bot.reply_to(message, response_text)
-                    return
-
-                # Si ya existe, conservamos la descripción
-                old_description = ''
-                if alias_name.lower() in aliases:
-                    old_description = aliases[alias_name.lower()].get('description', '')
-
-                aliases[alias_name.lower()] = {
-                    'command': alias_command,
-                    'description': old_description
-                }
-                save_aliases()
-                response_text = f"Alias '{alias_name}' registrado/actualizado."
-                logging.info(f"Sending response to {message.chat.id}: {response_text}")
-                bot.reply_to(message, response_text)
-                return
 
-            # Describir alias existente
-            if text_lower.startswith("describe alias "):
-                parts = remove_prefix(message.text, "describe alias ").strip().split(None, 1)
-                if len(parts) < 2:
-                    response_text = "Uso: describe alias <nombre> <descripcion>"
-                    logging.info(f"Sending response to {message.chat.id}: {response_text}")
-                    bot.reply_to(message, response_text)
-                    return
-                alias_name = parts[0].strip().lower()
-                alias_desc = parts[1].strip()
-                if alias_name not in aliases:
-                    response_text = f"El alias '{alias_name}' no existe."
-                    logging.info(f"Sending response to {message.chat.id}: {response_text}")
-                    bot.reply_to(message, response_text)
-                    return
-                aliases[alias_name]['description'] = alias_desc
-                save_aliases()
-                response_text = f"Descripción del alias '{alias_name}' actualizada."
-                logging.info(f"Sending response to {message.chat.id}: {response_text}")
-                bot.reply_to(message, response_text)
-                return
+@bot.message_handler()
+def process_message(message):
+    logging.info(f"Received text message from {message.from_user.id} ({message.from_user.username}): {message.text}")
+    this_chat_id = message.chat.id
+    if not message.text:
+        return
+    # Cada rama se mide como una etapa: message.<handler>, message.ask_ai...
+    start = time.monotonic()
+    stage = "message.unknown"
+    error = False
+    try:
+        is_authorized = state_store.is_authorized(this_chat_id)
 
-            if text_lower.startswith("load_aliases"):
-                load_aliases()
-                response_text = "Aliases cargados desde archivo."
-                logging.info(f"Sending response to {message.chat.id}: {response_text}")
-                bot.reply_to(message, response_text)
+        # Ayuda, autenticación, sesión y manejo de aliases
+        handler, args, auth = session_commands.match(message.text)
+        if handler and (is_authorized or not auth):
+            if handler(message, args) is not False:
+                stage = f"message.{handler.__name__}"
                 return
 
+        # Aquí sólo entran usuarios autorizados
+        if is_authorized:
             # Aplicamos alias si corresponde
-            user_input = apply_aliases(message.text)
-            user_input_lower = user_input.lower().strip()
-
-            # Bloque para sys <comando>
-            if user_input_lower.startswith("sys "):
-                cmd = f"TELEGRAM_BOT_CHAT_ID={this_chat_id} " + remove_prefix(user_input, "sys ")
-                response = os.popen(cmd + " 2>&1").read()
-                if not response:
-                    response = "Done."
-                logging.info(f"Sending response to {this_chat_id}: {response}")
-                bot.reply_to(message, truncate(response, 2500))
-
-            elif user_input_lower.startswith("ssys "):
-                cmd = f"TELEGRAM_BOT_CHAT_ID={this_chat_id} " + remove_prefix(user_input, "ssys ")
-                response = os.popen(cmd + " 2>&1").read()
-                if response:
-                    logging.info(f"Sending response to {this_chat_id}: {response}")
-                    bot.reply_to(message, truncate(response, 2500))
-
-            elif user_input_lower.startswith("sudo "):
-                if SUDO_PASSWORD is None:
-                    response_text = "SUDO_PASSWORD is not set."
-                    logging.info(f"Sending response to {this_chat_id}: {response_text}")
-                    bot.reply_to(message, response_text)
-                    return
-                cmd = f"TELEGRAM_BOT_CHAT_ID={this_chat_id} " + remove_prefix(user_input, "sudo ")
-                response = os.popen(
-                    "echo " + SUDO_PASSWORD + " | sudo -S -p \"\" " + cmd + " 2>&1"
-                ).read()
-                if not response:
-                    response = "Done."
-                logging.info(f"Sending response to {this_chat_id}: {response}")
-                bot.reply_to(message, truncate(response, 2500))
-
-            elif user_input_lower in ["reboot"]:
-                if SUDO_PASSWORD is None:
-                    response_text = "SUDO_PASSWORD is not set."
-                    logging.info(f"Sending response to {message.chat.id}: {response_text}")
-                    bot.reply_to(message, response_text)
-                    return
-                response = os.popen(
-                    "echo " + SUDO_PASSWORD + " | sudo -S -p '' shutdown -r now 2>&1"
-                ).read()
-                if not response:
-                    response = "Done."
-                logging.info(f"Sending response to {message.chat.id}: {response}")
-                bot.reply_to(message, truncate(response, 2500))
-
-            elif user_input_lower in ["shutdown"]:
-                if SUDO_PASSWORD is None:
-                    response_text = "SUDO_PASSWORD is not set."
-                    logging.info(f"Sending response to {message.chat.id}: {response_text}")
-                    bot.reply_to(message, response_text)
-                    return
-                response = os.popen(
-                    "echo " + SUDO_PASSWORD + " | sudo -S -p '' shutdown now 2>&1"
-                ).read()
-                if not response:
-                    response = "Done."
-                logging.info(f"Sending response to {message.chat.id}: {response}")
-                bot.reply_to(message, truncate(response, 2500))
-
-            elif user_input_lower in ["lock"]:
-                if SUDO_PASSWORD is None:
-                    response_text = "SUDO_PASSWORD is not set."
-                    logging.info(f"Sending response to {message.chat.id}: {response_text}")
-                    bot.reply_to(message, response_text)
-                    return
-                response = os.popen(
-                    "echo " + SUDO_PASSWORD + " | sudo -S -p '' loginctl lock-sessions 2>&1"
-                ).read()
-                if not response:
-                    response = "Done."
-                logging.info(f"Sending response to {message.chat.id}: {response}")
-                bot.reply_to(message, truncate(response, 2500))
-
-            elif user_input_lower in ["unlock"]:
-                if SUDO_PASSWORD is None:
-                    response_text = "SUDO_PASSWORD is not set."
-                    logging.info(f"Sending response to {message.chat.id}: {response_text}")
-                    bot.reply_to(message, response_text)
-                    return
-                response = os.popen(
-                    "echo " + SUDO_PASSWORD + " | sudo -S -p '' loginctl unlock-sessions 2>&1"
-                ).read()
-                if not response:
-                    response = "Done."
-                logging.info(f"Sending response to {message.chat.id}: {response}")
-                bot.reply_to(message, truncate(response, 2500))
-
-            elif user_input_lower.startswith("notify "):
-                if DBUS == "None":
-                    response_text = "DBUS_SESSION_BUS_ADDRESS is not set."
-                    logging.info(f"Sending response to {message.chat.id}: {response_text}")
-                    bot.reply_to(message, response_text)
-                else:
-                    response = os.popen('notify-send "'+remove_prefix(user_input, "notify ")+'" 2>&1').read()
-                    if not response:
-                        response = "Done."
-                    logging.info(f"Sending response to {message.chat.id}: {response}")
-                    bot.reply_to(message, truncate(response, 2500))
-
-            elif user_input_lower in ["picture","photo","foto"]:
-                try:
-                    response = str(os.popen('rm data/foto0*.jpeg').read())
-                    response = str(os.popen('export DISPLAY=:0.0;streamer -t 4 -r 2 -o data/foto00.jpeg').read())
-                    photo = open("data/foto03.jpeg", "rb")
-                    logging.info(f"Sending photo to {this_chat_id}")
-                    bot.send_photo(this_chat_id, photo)
-                    if not response:
-                        response = "Done."
-                except Exception as e:
-                    response_text = str(e)
-                    logging.info(f"Sending response to {message.chat.id}: {response_text}")
-                    bot.reply_to(message, response_text)
-
-            elif user_input_lower in ["screen", "screenshot", "pantalla", "captura"]:
-                try:
-                    if DISPLAY is None:
-                        response_text = "DISPLAY is not set."
-                        logging.info(f"Sending response to {message.chat.id}: {response_text}")
-                        bot.reply_to(message, response_text)
-                    os.popen('xhost +local: 2>&1').read()
-                    # Borramos las capturas previas
-                    os.popen('rm data/screen.png data/screen.jpg 2>&1').read()
-                    # Tomamos la nueva captura, guardamos en data
-                    os.popen('import -window root data/screen.png && convert data/screen.png data/screen.jpg 2>&1').read()
-                    with open("data/screen.jpg", "rb") as screen:
-                        logging.info(f"Sending photo to {this_chat_id}")
-                        bot.send_photo(this_chat_id, screen)
-                except Exception as e:
-                    response_text = str(e)
-                    logging.info(f"Sending response to {message.chat.id}: {response_text}")
-                    bot.reply_to(message, response_text)
+            user_input = alias_resolver.expand(message.text)
+            handler, args, _ = commands.match(user_input)
+            if handler:
+                stage = f"message.{handler.__name__}"
+                handler(message, args)
             else:
-                # Si está autorizado pero no coincide con ningún comando, ejecutamos el script ask_ai
-                response = ask_ai(message.chat.id, message.text)
-                logging.info(f"Sending response to {message.chat.id}: {response}")
-                bot.send_message(message.chat.id, truncate(response, 2500))
+                # Si está autorizado pero no coincide con ningún comando, se lo pasamos a la IA
+                # (la respuesta sale de ai_queue, que junta los mensajes seguidos)
+                stage = "message.ai_queue"
+                ai_queue.submit(message.chat.id, message)
         else:
             # Si NO está autorizado y escribe algo distinto a hi/login/etc.
+            stage = "message.unauthorized"
             response_text = "Comando desconocido. Use 'help' para ver la ayuda."
             logging.info(f"Sending response to {message.chat.id}: {response_text}")
             bot.reply_to(message, response_text)
 
     except Exception as e:
+        error = True
         response_text = "Error: "+str(e)
         logging.info(f"Sending response to {this_chat_id}: {response_text}")
         bot.send_message(this_chat_id, response_text)
+    finally:
+        metrics.observe(stage, time.monotonic() - start, error)
 
 
 # @bot.message_handler(content_types=['voice'])
 # def handle_voice_message(message):
-#     if message.chat.id not in authorized:
+#     if not state_store.is_authorized(message.chat.id):
 #         bot.reply_to(message, "No estás autorizado para enviar mensajes de audio.")
 #         return
 #
@@ -554,90 +908,94 @@ def process_message(message):
 @bot.message_handler(content_types=['voice'])
 def handle_voice_message(message):
     logging.info(f"Received voice message from {message.from_user.id} ({message.from_user.username})")
-    if message.chat.id not in authorized:
+    if not state_store.is_authorized(message.chat.id):
         response_text = "No estás autorizado para enviar mensajes de audio."
         logging.info(f"Sending response to {message.chat.id}: {response_text}")
         bot.reply_to(message, response_text)
         return
 
+    start = time.monotonic()
+    error = False
     try:
         this_chat_id = message.chat.id
+        if message.voice.file_size and message.voice.file_size > VOICE_MAX_BYTES:
+            response_text = f"El audio supera el límite de {VOICE_MAX_BYTES} bytes."
+            logging.info(f"Sending response to {message.chat.id}: {response_text}")
+            bot.reply_to(message, response_text)
+            return
+
         # Crear la carpeta si no existe
         audio_folder = '/tmp/telegrambot/'
         if not os.path.exists(audio_folder):
             os.makedirs(audio_folder)
 
         # Obtener el archivo de audio
-        file_info = bot.get_file(message.voice.file_id)
+        with metrics.timer("voice.get_file"):
+            file_info = bot.get_file(message.voice.file_id)
         file_path = file_info.file_path
-        file_url = f"https://api.telegram.org/file/bot{API_KEY}/{file_path}"
-
-        # Descargar el archivo de audio
-        response = requests.get(file_url)
-        if response.status_code == 200:
-            input_path = os.path.join(audio_folder, f"{message.voice.file_id}_original.ogg")
-            output_path = os.path.join(audio_folder, f"{message.voice.file_id}.ogg")
-
-            # Guardar el archivo original
-            with open(input_path, 'wb') as audio_file:
-                audio_file.write(response.content)
-
-            # Convertir a Ogg Vorbis usando ffmpeg
-            subprocess.run([
-                'ffmpeg', '-y', '-i', input_path,
-                '-c:a', 'libvorbis', output_path
-            ], check=True)
-
-            # Borrar el original si querés
-            os.remove(input_path)
-
-            cmd = f"TELEGRAM_BOT_CHAT_ID={this_chat_id} ./transcribe {output_path}"
-            transcription = os.popen(cmd + " 2>&1").read()
-            response_text = f"Entendí: {transcription}"
-            logging.info(f"Sending response to {message.chat.id}: {response_text}")
-            bot.reply_to(message, response_text)
-            ai_response = ask_ai(message.chat.id, transcription)
-            # bot.send_message(this_chat_id, f"{truncate(ai_response, 2500)}")
-            cmd = f"TELEGRAM_BOT_CHAT_ID={this_chat_id} ./botsay \"{ai_response}\""
-            botsay_response = os.popen(cmd + " 2>&1").read()
+        file_url = (apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}").format(API_KEY, file_path)
 
-        else:
-            response_text = "Error al descargar el archivo de audio."
-            logging.info(f"Sending response to {message.chat.id}: {response_text}")
+        # Todo lo temporal va en un directorio propio que se borra al terminar
+        with tempfile.TemporaryDirectory(dir=audio_folder) as work_dir:
+            input_path = os.path.join(work_dir, f"{message.voice.file_id}_original.ogg")
+
+            # Descargar el archivo de audio directo a disco
+            with metrics.timer("voice.download"):
+                downloaded = download_file(file_url, input_path, VOICE_MAX_BYTES)
+            if not downloaded:
+                response_text = "Error al descargar el archivo de audio."
+                logging.info(f"Sending response to {message.chat.id}: {response_text}")
+                bot.reply_to(message, response_text)
+                return
+
+            audio_path = input_path
+            if VOICE_TRANSCODE:
+                # Convertir a Ogg Vorbis usando ffmpeg
+                audio_path = os.path.join(work_dir, f"{message.voice.file_id}.ogg")
+                with metrics.timer("voice.ffmpeg"):
+                    subprocess.run([
+                        'ffmpeg', '-y', '-loglevel', 'error', '-i', input_path,
+                        '-c:a', 'libvorbis', audio_path
+                    ], check=True, timeout=runner.DEFAULT_TIMEOUT)
+
+            with metrics.timer("voice.transcribe"):
+                transcription = transcribe_audio(this_chat_id, audio_path)
+
+        response_text = f"Entendí: {transcription}"
+        logging.info(f"Sending response to {message.chat.id}: {response_text}")
+        with metrics.timer("voice.reply_text"):
             bot.reply_to(message, response_text)
+        ai_response = ask_ai(message.chat.id, transcription)
+        # bot.send_message(this_chat_id, f"{truncate(ai_response, 2500)}")
+        send_voice_reply(this_chat_id, ai_response)
     except Exception as e:
+        error = True
         response_text = f"Error al procesar el mensaje de audio: {str(e)}"
         logging.info(f"Sending response to {message.chat.id}: {response_text}")
         bot.reply_to(message, response_text)
+    finally:
+        metrics.observe("voice.total", time.monotonic() - start, error)
 
 
-def remove_prefix(text, prefix):
-    if text.lower().startswith(prefix.lower()):
-        return text[len(prefix):]
-    return text
-
-
-def last_chat_ids():
-    if not os.path.exists("last_admin_chat_ids"):
-        return []
-    with open("last_admin_chat_ids", "r") as f:
-        ids_str = f.read()
-        if not ids_str:
-            return []
-    return list(map(int, ids_str.split(',')))
-
-
-def persist_chat_ids():
-    with open("last_admin_chat_ids", "w") as f:
-        f.write(','.join(map(str, authorized)))
-
-
-def truncate(message, max_bytes):
-    encoded_message = message.encode('utf-8')
-    if len(encoded_message) > max_bytes:
-        return encoded_message[:max_bytes].decode('utf-8', 'ignore')
-    else:
-        return message
+def download_file(file_url, dest_path, max_bytes):
+    """
+    Descarga file_url en streaming a dest_path, sin cargarlo entero en memoria.
+    Devuelve False si el servidor no responde 200 y lanza ValueError si el
+    archivo supera max_bytes.
+    """
+    with requests.get(file_url, stream=True, timeout=60) as response:
+        if response.status_code != 200:
+            return False
+        if int(response.headers.get('Content-Length') or 0) > max_bytes:
+            raise ValueError(f"El archivo supera el límite de {max_bytes} bytes.")
+        written = 0
+        with open(dest_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                written += len(chunk)
+                if written > max_bytes:
+                    raise ValueError(f"El archivo supera el límite de {max_bytes} bytes.")
+                f.write(chunk)
+    return True
 
 
 def create_folder(folder):
@@ -651,22 +1009,74 @@ def create_folder(folder):
 # Llamamos a la función para crear la carpeta 'data' si no existe
 create_folder('data')
 
-# Cargamos el último chat ID que estaba autorizado antes (si lo hubiera)
-last_chat_ids_list = last_chat_ids()
-authorized.extend(last_chat_ids_list)
+# Migramos los chats autorizados del viejo last_admin_chat_ids (si lo hubiera)
+state_store.import_chat_ids_file("last_admin_chat_ids", SESSION_TTL)
+state_store.purge_expired()
+
+def stale_update_policy(update):
+    """
+    Qué hacer con un update que llegó tarde (ver dispatcher.install): los
+    reinicios y comandos de sistema viejos se descartan, y de las capturas y
+    fotos pendientes sólo se toma la última de cada chat.
+    """
+    message = update.message
+    if message is None or not message.text:
+        return None
+    handler, _, _ = session_commands.match(message.text)
+    if handler in (cmd_restart, cmd_restart_full):
+        return dispatcher.DROP
+    if handler is not None:
+        return None
+    try:
+        handler, _, _ = commands.match(alias_resolver.expand(message.text))
+    except AliasCycleError:
+        return None
+    if handler is None:
+        return None
+    if handler.__name__ in {f"cmd_{name}" for name in SUDO_COMMANDS}:
+        return dispatcher.DROP
+    if handler in (cmd_screen, cmd_photo):
+        return handler.__name__
+    return None
+
 
-# 1) Carga los aliases predefinidos (read-only)
-load_builtin_aliases()
+def notify_dropped_updates(chat_id, updates):
+    ignored = ", ".join(update.message.text for update in updates)
+    response_text = f"Ignoré {len(updates)} comando(s) que llegaron mientras el bot no estaba: {ignored}"
+    logging.info(f"Sending response to {chat_id}: {response_text}")
+    bot.send_message(chat_id, response_text)
 
-# 2) Cargamos los aliases del usuario
-load_aliases()
+
+def persist_update_offset(update_id):
+    state_store.set_meta("update_offset", str(update_id))
+
+
+# Seguimos desde el último update procesado (si no, al reiniciar se repite
+# el último lote, incluido el propio `restart`)
+bot.last_update_id = int(state_store.get_meta("update_offset", "0"))
+
+# Despachamos los updates en paralelo, serializados por chat
+dispatcher.install(bot, dispatcher.ChatDispatcher(max_workers=DISPATCH_WORKERS),
+                   on_offset=persist_update_offset,
+                   stale_after=STALE_UPDATE_SECONDS,
+                   stale_policy=stale_update_policy,
+                   on_dropped=notify_dropped_updates)
 
 # Iniciamos el bot
-logging.info(f"Starting Telegram bot polling (level={LOG_LEVEL}, file='{LOG_FILE}')")
-try:
-    bot.polling()
-except Exception as e:
-    logging.exception(f"Unhandled exception while polling: {e}")
+if BOT_MODE == "webhook":
+    logging.info(f"Starting Telegram bot webhook (level={LOG_LEVEL}, file='{LOG_FILE}', workers={DISPATCH_WORKERS})")
+    try:
+        webhook.serve(bot, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL or None)
+    except Exception as e:
+        logging.exception(f"Unhandled exception while serving webhook: {e}")
+else:
+    logging.info(f"Starting Telegram bot polling (level={LOG_LEVEL}, file='{LOG_FILE}', workers={DISPATCH_WORKERS})")
+    try:
+        # getUpdates no funciona mientras haya un webhook registrado
+        bot.remove_webhook()
+        bot.polling()
+    except Exception as e:
+        logging.exception(f"Unhandled exception while polling: {e}")
 
 # Actualizamos last_chat_id
 #last_chat_id_int = last_chat_id()
@@ -1,101 +1,182 @@
 #!/usr/bin/env python
 
 import argparse
+import hashlib
 import os
 from dotenv import load_dotenv
+
+load_dotenv()  # antes de importar state, que lee STATE_DB al importarse
+
 import telebot
 import mimetypes
+from telebot import apihelper
 from telebot.apihelper import ApiTelegramException
 import sys
 
-load_dotenv()
+import state
 
 API_KEY = os.getenv('API_KEY')
-
-def last_chat_ids():
-    if not os.path.exists("last_admin_chat_ids"):
-        return []
-    with open("last_admin_chat_ids", "r") as f:
-        ids_str = f.read()
-        if not ids_str:
-            return []
-    return list(map(int, ids_str.split(',')))
-
-CHAT_IDS = last_chat_ids()
-
-if not API_KEY:
-    print("Falta API_KEY en el entorno.")
-    sys.exit(1)
-
-bot = telebot.TeleBot(API_KEY)
-
-parser = argparse.ArgumentParser(description="Enviar mensajes o archivos por Telegram desde línea de comandos.")
-
-parser.add_argument('--message', help='Texto del mensaje a enviar. Si no se proporciona, se puede recibir desde stdin.')
-parser.add_argument('--audio', help='Archivo de audio (ogg, mp3, wav)')
-parser.add_argument('--image', help='Archivo de imagen (jpg, png, etc)')
-parser.add_argument('--attach', help='Cualquier archivo para enviar como documento')
-parser.add_argument('--voice', help='Nota de voz (ogg, wav, etc) enviada como mensaje de voz de Telegram')
-parser.add_argument('--chat-id', help='Chat ID para enviar el mensaje. Si no se proporciona, se usarán todos los IDs de usuarios conectados.')
-
-args = parser.parse_args()
-
-# Determinar los chat IDs a usar
-env_chat_id = os.getenv('TELEGRAM_BOT_CHAT_ID')
-if args.chat_id:
-    target_chat_ids = [int(args.chat_id)]
-elif env_chat_id:
-    target_chat_ids = [int(env_chat_id)]
-else:
-    target_chat_ids = CHAT_IDS
-
-# Envío de mensaje de texto
-try:
-    if args.message:
-        for chat_id in target_chat_ids:
-            bot.send_message(chat_id, args.message)
-    elif not sys.stdin.isatty():
-        # Leer de stdin si hay datos disponibles
-        stdin_message = sys.stdin.read().strip()
-        if stdin_message:
-            for chat_id in target_chat_ids:
-                bot.send_message(chat_id, stdin_message)
-
-    # Envío de audio
-    if args.audio:
-        if not os.path.isfile(args.audio):
-            print(f"Archivo de audio no encontrado: {args.audio}")
-            sys.exit(1)
-        with open(args.audio, 'rb') as audio:
-            for chat_id in target_chat_ids:
-                bot.send_audio(chat_id, audio)
-
-    # Envío de imagen
-    if args.image:
-        if not os.path.isfile(args.image):
-            print(f"Imagen no encontrada: {args.image}")
-            sys.exit(1)
-        with open(args.image, 'rb') as img:
-            for chat_id in target_chat_ids:
-                bot.send_photo(chat_id, img)
-
-    # Envío de cualquier archivo
-    if args.attach:
-        if not os.path.isfile(args.attach):
-            print(f"Archivo no encontrado: {args.attach}")
-            sys.exit(1)
-        with open(args.attach, 'rb') as doc:
-            for chat_id in target_chat_ids:
-                bot.send_document(chat_id, doc)
-
-    # Envío de nota de voz (mensaje de voz)
-    if args.voice:
-        if not os.path.isfile(args.voice):
-            print(f"Archivo de voz no encontrado: {args.voice}")
-            sys.exit(1)
-        with open(args.voice, 'rb') as voice:
+# Servidor de la Bot API (vacío = api.telegram.org); p.ej. el de bench/fake_telegram.py
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')
+
+# Tipo de archivo -> (método del bot, atributo del mensaje enviado)
+SENDERS = {
+    "audio": ("send_audio", "audio"),
+    "image": ("send_photo", "photo"),
+    "attach": ("send_document", "document"),
+    "voice": ("send_voice", "voice"),
+}
+
+def use_api_server(base_url):
+    """Apunta telebot (API y descarga de archivos) a otro servidor de la Bot API."""
+    base_url = base_url.rstrip('/')
+    apihelper.API_URL = base_url + "/bot{0}/{1}"
+    apihelper.FILE_URL = base_url + "/file/bot{0}/{1}"
+
+
+def last_chat_ids(store=None):
+    """Chats con sesión vigente en el bot (según la base de estado compartida)."""
+    return (store or state.StateStore()).sessions()
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sent_file_id(message, kind):
+    """Extrae el file_id del mensaje que devolvió Telegram tras el envío."""
+    media = getattr(message, SENDERS[kind][1], None)
+    if isinstance(media, list):
+        # Las fotos vienen en varios tamaños: el último es el original
+        media = media[-1] if media else None
+    return getattr(media, 'file_id', None)
+
+
+class FileIdCache:
+    """
+    Recuerda el file_id que Telegram asignó a cada archivo ya subido (por hash
+    de contenido y tipo), para reenviarlo sin volver a subir los bytes. Vive
+    en la base de estado, así que lo comparten el bot y esta herramienta.
+    """
+
+    def __init__(self, store=None):
+        self.store = store or state.StateStore()
+
+    def get(self, digest, kind):
+        return self.store.get_file_id(digest, kind)
+
+    def put(self, digest, kind, file_id):
+        self.store.put_file_id(digest, kind, file_id)
+
+    def discard(self, digest, kind):
+        self.store.discard_file_id(digest, kind)
+
+
+def stale_file_id(error):
+    """
+    True si Telegram rechazó el file_id en sí (caducado, de otro bot o de
+    otro tipo), el único caso en que conviene volver a subir el archivo.
+    """
+    description = (error.description or "").lower()
+    return error.error_code == 400 and ("file identifier" in description or "file_id" in description)
+
+
+def send_file(bot, kind, path, chat_ids, cache=None, **kwargs):
+    """
+    Envía el archivo a todos los chats subiéndolo como mucho una vez: el
+    primer envío devuelve un file_id que se usa para el resto. Con cache, si
+    el mismo contenido ya se subió antes, no se sube nada.
+    """
+    method = getattr(bot, SENDERS[kind][0])
+    digest = file_hash(path)
+    file_id = cache.get(digest, kind) if cache else None
+    for chat_id in chat_ids:
+        if file_id:
+            try:
+                method(chat_id, file_id, **kwargs)
+                continue
+            except ApiTelegramException as e:
+                # Límites (429), chat bloqueado (403), etc. no son culpa del file_id
+                if not stale_file_id(e):
+                    raise
+                # file_id caducado o de otro bot: volvemos a subir el archivo
+                if cache:
+                    cache.discard(digest, kind)
+                file_id = None
+        with open(path, 'rb') as fh:
+            message = method(chat_id, fh, **kwargs)
+        file_id = sent_file_id(message, kind)
+        if cache and file_id:
+            cache.put(digest, kind, file_id)
+
+
+def main():
+    if not API_KEY:
+        print("Falta API_KEY en el entorno.")
+        sys.exit(1)
+
+    if TELEGRAM_API_URL:
+        use_api_server(TELEGRAM_API_URL)
+    bot = telebot.TeleBot(API_KEY)
+
+    parser = argparse.ArgumentParser(description="Enviar mensajes o archivos por Telegram desde línea de comandos.")
+
+    parser.add_argument('--message', help='Texto del mensaje a enviar. Si no se proporciona, se puede recibir desde stdin.')
+    parser.add_argument('--audio', help='Archivo de audio (ogg, mp3, wav)')
+    parser.add_argument('--image', help='Archivo de imagen (jpg, png, etc)')
+    parser.add_argument('--attach', help='Cualquier archivo para enviar como documento')
+    parser.add_argument('--voice', help='Nota de voz (ogg, wav, etc) enviada como mensaje de voz de Telegram')
+    parser.add_argument('--chat-id', help='Chat ID para enviar el mensaje. Si no se proporciona, se usarán todos los IDs de usuarios conectados.')
+    parser.add_argument('--no-cache', help='No reutilizar file_ids de envíos anteriores', action='store_true')
+
+    args = parser.parse_args()
+
+    # Determinar los chat IDs a usar
+    env_chat_id = os.getenv('TELEGRAM_BOT_CHAT_ID')
+    if args.chat_id:
+        target_chat_ids = [int(args.chat_id)]
+    elif env_chat_id:
+        target_chat_ids = [int(env_chat_id)]
+    else:
+        target_chat_ids = last_chat_ids()
+
+    cache = None if args.no_cache else FileIdCache()
+
+    # Envío de mensaje de texto
+    try:
+        if args.message:
             for chat_id in target_chat_ids:
-                bot.send_voice(chat_id, voice)
-except ApiTelegramException as e:
-    print(f"Error al enviar mensaje: {e}")
-    sys.exit(1)
+                bot.send_message(chat_id, args.message)
+        elif not sys.stdin.isatty():
+            # Leer de stdin si hay datos disponibles
+            stdin_message = sys.stdin.read().strip()
+            if stdin_message:
+                for chat_id in target_chat_ids:
+                    bot.send_message(chat_id, stdin_message)
+
+        # Envío de audio, imagen, cualquier archivo y nota de voz
+        not_found = {
+            "audio": "Archivo de audio no encontrado",
+            "image": "Imagen no encontrada",
+            "attach": "Archivo no encontrado",
+            "voice": "Archivo de voz no encontrado",
+        }
+        for kind, error in not_found.items():
+            path = getattr(args, kind)
+            if not path:
+                continue
+            if not os.path.isfile(path):
+                print(f"{error}: {path}")
+                sys.exit(1)
+            send_file(bot, kind, path, target_chat_ids, cache)
+    except ApiTelegramException as e:
+        print(f"Error al enviar mensaje: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
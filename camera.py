@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Cámara "tibia" para el comando `photo`: un hilo mantiene el dispositivo
+abierto y guarda los últimos cuadros en un buffer circular en memoria, así la
+foto sale al instante en lugar de abrir la cámara, esperar a que se ajuste la
+exposición y tirar los primeros cuadros en cada pedido (streamer -t 4).
+
+La cámara se abre con el primer pedido y se cierra tras keep_alive segundos
+sin pedidos (o nunca, con keep_alive=0). La fuente de cuadros es
+intercambiable: OpenCVSource para una webcam real, FakeSource para pruebas.
+
+Uso suelto: python camera.py [--fake] [--device 0] [salida.jpg]
+"""
+import argparse
+import io
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+DEVICE = os.getenv("CAMERA_DEVICE", "0")
+FPS = float(os.getenv("CAMERA_FPS", "5"))
+# Tiempo desde que se abre la cámara hasta que la exposición se estabiliza
+SETTLE_SECONDS = float(os.getenv("CAMERA_SETTLE_SECONDS", "2"))
+KEEP_ALIVE = float(os.getenv("CAMERA_KEEP_ALIVE", "120"))
+QUALITY = int(os.getenv("CAMERA_QUALITY", "85"))
+WIDTH = int(os.getenv("CAMERA_WIDTH", "0"))  # 0 = lo que dé la cámara
+HEIGHT = int(os.getenv("CAMERA_HEIGHT", "0"))
+BUFFER_FRAMES = 4
+
+
+class CameraError(RuntimeError):
+    pass
+
+
+class OpenCVSource:
+    """Webcam vía OpenCV (pip install opencv-python-headless)."""
+
+    def __init__(self, device=DEVICE, width=WIDTH, height=HEIGHT, quality=QUALITY):
+        self.device = int(device) if str(device).isdigit() else device
+        self.width = width
+        self.height = height
+        self.quality = quality
+        self._capture = None
+
+    def open(self):
+        import cv2
+
+        capture = cv2.VideoCapture(self.device)
+        if not capture.isOpened():
+            raise CameraError(f"No se pudo abrir la cámara {self.device}")
+        if self.width and self.height:
+            capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        # Sin cola de cuadros en el driver: queremos el más reciente, no uno viejo
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self._capture = capture
+
+    def read(self):
+        ok, frame = self._capture.read()
+        if not ok:
+            raise CameraError(f"No se pudo leer un cuadro de la cámara {self.device}")
+        return frame
+
+    def encode(self, frame):
+        import cv2
+
+        ok, data = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise CameraError("No se pudo codificar el cuadro a JPEG")
+        return data.tobytes()
+
+    def close(self):
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+
+class FakeSource:
+    """
+    Fuente de prueba: entrega cuadros numerados (o los de frames, en ciclo)
+    a fps cuadros por segundo. encode() devuelve el cuadro tal cual si ya son
+    bytes, o su número como texto.
+    """
+
+    def __init__(self, frames=None, fps=30, open_delay=0):
+        self.frames = list(frames) if frames else None
+        self.fps = fps
+        self.open_delay = open_delay
+        self.opened = 0
+        self.closed = 0
+        self._count = 0
+
+    def open(self):
+        time.sleep(self.open_delay)
+        self.opened += 1
+
+    def read(self):
+        time.sleep(1 / self.fps)
+        self._count += 1
+        if self.frames:
+            return self.frames[(self._count - 1) % len(self.frames)]
+        return self._count
+
+    def encode(self, frame):
+        return frame if isinstance(frame, bytes) else str(frame).encode()
+
+    def close(self):
+        self.closed += 1
+
+
+class CameraService:
+    """
+    Mantiene la cámara abierta mientras se use y los últimos buffer_frames
+    cuadros en memoria. photo() devuelve el último cuadro ya estabilizado
+    (SETTLE_SECONDS después de abrir), esperando si hace falta.
+    """
+
+    def __init__(self, source, fps=FPS, settle_seconds=SETTLE_SECONDS, keep_alive=KEEP_ALIVE,
+                 buffer_frames=BUFFER_FRAMES):
+        self.source = source
+        self.fps = fps
+        self.settle_seconds = settle_seconds
+        self.keep_alive = keep_alive
+        self.frames = deque(maxlen=buffer_frames)  # (time.monotonic(), cuadro), sólo ya estabilizados
+        self.error = None
+        self._last_used = 0.0
+        self._waiting = 0  # pedidos esperando un cuadro (mientras haya, no se cierra)
+        self._thread = None
+        self._cond = threading.Condition()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        """Abre la cámara (en el hilo de captura) si no está abierta."""
+        with self._cond:
+            self._last_used = time.monotonic()
+            if self._thread is None:
+                self.error = None
+                self._thread = threading.Thread(target=self._run, name="camera", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._cond.notify_all()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self):
+        thread = threading.current_thread()
+        try:
+            self.source.open()
+        except Exception as e:
+            logging.error(f"Error opening camera: {str(e)}")
+            with self._cond:
+                self.error = e
+                self._thread = None
+                self._cond.notify_all()
+            return
+        opened = time.monotonic()
+        logging.info("Camera opened")
+        try:
+            while True:
+                start = time.monotonic()
+                with self._cond:
+                    idle = 0 if self._waiting else start - self._last_used
+                    if self._thread is not thread or (self.keep_alive and idle > self.keep_alive):
+                        break
+                frame = self.source.read()
+                now = time.monotonic()
+                if now - opened >= self.settle_seconds:
+                    with self._cond:
+                        self.frames.append((now, frame))
+                        self._cond.notify_all()
+                # Leemos más lento que la cámara: menos CPU, y el driver descarta el resto
+                wait = 1 / self.fps - (time.monotonic() - start)
+                if wait > 0:
+                    time.sleep(wait)
+        except Exception as e:
+            logging.error(f"Error reading camera: {str(e)}")
+            with self._cond:
+                self.error = e
+        finally:
+            self.source.close()
+            with self._cond:
+                self.frames.clear()
+                if self._thread is thread:
+                    self._thread = None
+                self._cond.notify_all()
+            logging.info("Camera closed")
+
+    def latest(self, timeout=10):
+        """El último cuadro estabilizado, sin codificar. Abre la cámara si hace falta."""
+        self.start()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._waiting += 1
+            try:
+                while not self.frames:
+                    if self._thread is None:
+                        if self.error is not None:
+                            raise CameraError(f"La cámara falló: {self.error}")
+                        # Se cerró por inactividad justo antes del pedido: la volvemos a abrir
+                        self.start()
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise CameraError(f"La cámara no entregó un cuadro en {timeout:g}s")
+                    self._cond.wait(remaining)
+                return self.frames[-1][1]
+            finally:
+                self._waiting -= 1
+                self._last_used = time.monotonic()
+
+    def photo(self, timeout=10):
+        """BytesIO con el JPEG del último cuadro estabilizado, listo para bot.send_photo."""
+        photo = io.BytesIO(self.source.encode(self.latest(timeout)))
+        photo.name = "photo.jpg"
+        return photo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Saca una foto con CameraService (fría y tibia).")
+    parser.add_argument("output", nargs="?", default="photo.jpg")
+    parser.add_argument("--fake", action="store_true", help="Usar FakeSource en lugar de la webcam")
+    parser.add_argument("--device", default=DEVICE)
+    args = parser.parse_args()
+
+    source = FakeSource(open_delay=0.5) if args.fake else OpenCVSource(args.device)
+    camera = CameraService(source)
+    for label in ("fría", "tibia"):
+        start = time.monotonic()
+        photo = camera.photo()
+        print(f"Foto {label}: {(time.monotonic() - start) * 1000:.0f}ms, {len(photo.getvalue())} bytes")
+    with open(args.output, "wb") as f:
+        f.write(photo.getvalue())
+    camera.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Cola por chat delante de la IA: los mensajes que llegan mientras hay un
+pedido en curso, o dentro de una ventana corta, se juntan en un solo pedido.
+
+Corre en su propio pool de hilos, fuera de las colas de dispatcher.py: así
+un chat puede seguir mandando mensajes (o comandos) mientras la IA responde.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _Chat:
+    def __init__(self):
+        self.pending = []       # mensajes a la espera del próximo pedido
+        self.first = None       # cuándo llegó el primero de pending (time.monotonic)
+        self.last = None        # cuándo llegó el último de pending
+        self.cancel = None      # threading.Event del pedido en curso
+        self.running = None     # mensajes del pedido en curso
+
+
+class ChatCoalescer:
+    """
+    handler(chat_id, messages, cancel) atiende un grupo de mensajes de un
+    chat (en orden de llegada); cancel es un threading.Event. Si el handler
+    devuelve False se considera cancelado y sus mensajes vuelven al
+    principio de la cola, para el próximo pedido.
+
+    window: segundos sin mensajes nuevos que se esperan antes de pedir.
+    max_wait: tope de esa espera, contado desde el primer mensaje.
+    policy: "wait" deja terminar el pedido en curso y junta lo que llegue
+    para el siguiente; "cancel" lo cancela y vuelve a pedir con todo junto.
+    """
+
+    def __init__(self, handler, window=1.0, max_wait=5.0, policy="wait", max_workers=4):
+        self.handler = handler
+        self.window = window
+        self.max_wait = max_wait
+        self.policy = policy
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ai")
+        self._lock = threading.Lock()
+        self._chats = {}
+
+    def submit(self, chat_id, message):
+        now = time.monotonic()
+        with self._lock:
+            chat = self._chats.get(chat_id)
+            start = chat is None
+            if start:
+                chat = self._chats[chat_id] = _Chat()
+            if not chat.pending:
+                chat.first = now
+            chat.pending.append(message)
+            chat.last = now
+            if chat.cancel is not None and self.policy == "cancel":
+                logging.info(f"Cancelling AI request for chat {chat_id}: new message arrived")
+                chat.cancel.set()
+        if start:
+            self._executor.submit(self._drain, chat_id)
+
+    def _next_batch(self, chat_id):
+        """Espera la ventana y devuelve (mensajes, cancel, espera), o None si no queda nada."""
+        while True:
+            with self._lock:
+                chat = self._chats[chat_id]
+                if not chat.pending:
+                    del self._chats[chat_id]
+                    return None
+                now = time.monotonic()
+                wait = min(chat.last + self.window, chat.first + self.max_wait) - now
+                if wait <= 0:
+                    messages, chat.pending = chat.pending, []
+                    chat.running = messages
+                    chat.cancel = threading.Event()
+                    return messages, chat.cancel, now - chat.first
+            time.sleep(wait)
+
+    def _drain(self, chat_id):
+        while True:
+            batch = self._next_batch(chat_id)
+            if batch is None:
+                return
+            messages, cancel, waited = batch
+            if len(messages) > 1:
+                logging.info(f"Coalesced {len(messages)} messages for chat {chat_id} after {waited:.2f}s")
+            try:
+                done = self.handler(chat_id, messages, cancel) is not False
+            except Exception as e:
+                logging.exception(f"Unhandled exception in AI handler for chat {chat_id}: {e}")
+                done = True
+            with self._lock:
+                chat = self._chats[chat_id]
+                chat.cancel = chat.running = None
+                if not done:
+                    # Cancelado: se vuelve a pedir junto con lo que llegó después
+                    chat.pending = messages + chat.pending
+                    chat.first = time.monotonic()
+
+    def pending(self):
+        with self._lock:
+            return {chat_id: len(chat.pending) + len(chat.running or ()) for chat_id, chat in self._chats.items()}
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
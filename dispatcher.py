@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Despachador concurrente de updates de Telegram.
+
+Cada chat tiene su propia cola: los mensajes de un mismo chat se procesan en
+orden, pero chats distintos corren en paralelo sobre un pool acotado de hilos.
+
+Los updates que llegan viejos (acumulados mientras el bot estaba caído o
+reiniciándose) pueden descartarse o combinarse antes de encolarse: ver install().
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Lo que devuelve stale_policy para descartar un update viejo
+DROP = object()
+
+
+def update_message(update):
+    """Devuelve el mensaje de un update (o None si no trae ninguno)."""
+    for attr in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        msg = getattr(update, attr, None)
+        if msg is not None:
+            return msg
+    callback = getattr(update, "callback_query", None)
+    if callback is not None:
+        return callback.message
+    return None
+
+
+def update_chat_id(update):
+    """Devuelve el chat.id asociado a un update (o None si no tiene chat)."""
+    msg = update_message(update)
+    return msg.chat.id if msg is not None else None
+
+
+class ChatDispatcher:
+    """Ejecuta tareas en un pool de hilos, serializadas por clave (chat.id)."""
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat")
+        self._lock = threading.Lock()
+        self._queues = {}  # clave -> deque de tareas pendientes
+
+    def submit(self, key, fn, *args, **kwargs):
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is not None:
+                # Ya hay un drenado en curso para este chat: se encola detrás
+                queue.append((fn, args, kwargs))
+                return
+            self._queues[key] = deque([(fn, args, kwargs)])
+        self._executor.submit(self._run_next, key)
+
+    def _run_next(self, key):
+        with self._lock:
+            fn, args, kwargs = self._queues[key][0]
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            logging.exception(f"Unhandled exception in handler for chat {key}: {e}")
+        with self._lock:
+            queue = self._queues[key]
+            queue.popleft()
+            if not queue:
+                del self._queues[key]
+                return
+        # Re-encolamos en vez de drenar todo de una vez, para no acaparar un
+        # hilo con un chat muy activo mientras otros esperan.
+        self._executor.submit(self._run_next, key)
+
+    def pending(self):
+        with self._lock:
+            return {key: len(queue) for key, queue in self._queues.items()}
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def install(bot, dispatcher, on_offset=None, stale_after=0, stale_policy=None, on_dropped=None):
+    """
+    Reemplaza bot.process_new_updates para que cada update se procese en el
+    dispatcher. El bot debe crearse con threaded=False.
+
+    on_offset(update_id) se llama después de cada lote con el último
+    update_id, para persistirlo y no repetir updates al reiniciar.
+
+    Con stale_after > 0, cada update cuyo mensaje tenga más de stale_after
+    segundos pasa por stale_policy(update), que devuelve None (se procesa
+    normalmente), DROP (se descarta; on_dropped(chat_id, updates) se encola en
+    el chat para avisar) o una clave: de los updates viejos de un chat con la
+    misma clave sólo se procesa el último.
+    """
+    process_updates = bot.process_new_updates
+    latest = {}  # (chat_id, clave) -> update_id del último update viejo con esa clave
+    latest_lock = threading.Lock()
+
+    def process_latest(slot, update):
+        with latest_lock:
+            superseded = latest.get(slot) != update.update_id
+            if not superseded:
+                del latest[slot]
+        if superseded:
+            logging.info(f"Skipping stale update {update.update_id} for chat {slot[0]}: superseded by a newer '{slot[1]}'")
+            return
+        process_updates([update])
+
+    def classify(update, now):
+        if not stale_after or stale_policy is None:
+            return None
+        msg = update_message(update)
+        if msg is None or now - msg.date <= stale_after:
+            return None
+        try:
+            return stale_policy(update)
+        except Exception as e:
+            logging.exception(f"Error classifying stale update {update.update_id}: {e}")
+            return None
+
+    def process_new_updates(updates):
+        now = time.time()
+        dropped = {}
+        for update in updates:
+            # El offset se avanza aquí, de forma síncrona: si esperáramos al
+            # handler, el siguiente getUpdates volvería a traer el mismo update.
+            if update.update_id > bot.last_update_id:
+                bot.last_update_id = update.update_id
+            chat_id = update_chat_id(update)
+            decision = classify(update, now)
+            if decision is DROP:
+                dropped.setdefault(chat_id, []).append(update)
+            elif decision is not None:
+                slot = (chat_id, decision)
+                with latest_lock:
+                    latest[slot] = update.update_id
+                dispatcher.submit(chat_id, process_latest, slot, update)
+            else:
+                dispatcher.submit(chat_id, process_updates, [update])
+        for chat_id, stale in dropped.items():
+            logging.info(f"Dropped {len(stale)} stale update(s) for chat {chat_id}")
+            if on_dropped is not None:
+                dispatcher.submit(chat_id, on_dropped, chat_id, stale)
+        if updates and on_offset is not None:
+            try:
+                on_offset(bot.last_update_id)
+            except Exception as e:
+                logging.error(f"Error persisting update offset {bot.last_update_id}: {str(e)}")
+
+    bot.process_new_updates = process_new_updates
+    return dispatcher
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Trabajos en segundo plano para comandos largos (`sys <comando> &`).
+
+Cada trabajo corre con runner.run (en su propio grupo de procesos, sin
+tiempo máximo), guarda su salida en un buffer circular acotado y avisa por
+callback cuando termina.
+"""
+import threading
+import time
+from collections import deque
+
+import runner
+
+
+class RingBuffer:
+    """Guarda sólo los últimos max_bytes de texto recibido."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._chunks = deque()
+        self._size = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        if not text:
+            return
+        with self._lock:
+            self._chunks.append(text)
+            self._size += len(text)
+            while self._size > self.max_bytes and len(self._chunks) > 1:
+                old = self._chunks.popleft()
+                self._size -= len(old)
+                self.dropped += len(old)
+            if self._size > self.max_bytes:
+                # Un único fragmento más grande que el buffer: nos quedamos con el final
+                excess = self._size - self.max_bytes
+                self._chunks[0] = self._chunks[0][excess:]
+                self._size -= excess
+                self.dropped += excess
+
+    def tail(self, max_chars=None):
+        with self._lock:
+            text = "".join(self._chunks)
+        if max_chars is not None and len(text) > max_chars:
+            return text[-max_chars:]
+        return text
+
+
+class Job:
+    def __init__(self, job_id, chat_id, command, max_output_bytes):
+        self.id = job_id
+        self.chat_id = chat_id
+        self.command = command
+        self.cancel = threading.Event()
+        self.output = RingBuffer(max_output_bytes)
+        self.started = time.time()
+        self.ended = None
+        self.returncode = None
+
+    @property
+    def running(self):
+        return self.returncode is None
+
+    @property
+    def elapsed(self):
+        return (self.ended or time.time()) - self.started
+
+    def describe(self):
+        state = "corriendo" if self.running else f"exit {self.returncode}"
+        return f"[{self.id}] {state} · {self.elapsed:.0f}s · {self.command}"
+
+
+class JobManager:
+    """
+    Tabla de trabajos en segundo plano. on_exit(job) se llama desde el hilo
+    lector cuando el proceso termina. Se conservan los últimos keep_finished
+    trabajos terminados para poder consultar su salida.
+    """
+
+    def __init__(self, max_output_bytes=64 * 1024, keep_finished=20, on_exit=None):
+        self.max_output_bytes = max_output_bytes
+        self.keep_finished = keep_finished
+        self.on_exit = on_exit
+        self._jobs = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def start(self, chat_id, command, shell_command=None):
+        """Lanza shell_command (o command) en segundo plano y devuelve el Job."""
+        with self._lock:
+            job = Job(self._next_id, chat_id, command, self.max_output_bytes)
+            self._jobs[job.id] = job
+            self._next_id += 1
+        threading.Thread(target=self._run, args=(job, shell_command or command),
+                         name=f"job-{job.id}", daemon=True).start()
+        return job
+
+    def _run(self, job, shell_command):
+        try:
+            result = runner.run(shell_command, timeout=None, max_bytes=None,
+                                on_output=job.output.write, cancel=job.cancel, capture=False)
+            job.returncode = result.returncode
+        except Exception as e:
+            job.output.write(f"\nError: {e}")
+            job.returncode = -1
+        job.ended = time.time()
+        self._prune()
+        if self.on_exit:
+            self.on_exit(job)
+
+    def _prune(self):
+        with self._lock:
+            finished = [j for j in self._jobs.values() if not j.running]
+            for job in finished[:-self.keep_finished or None]:
+                del self._jobs[job.id]
+
+    def list(self, chat_id=None):
+        with self._lock:
+            return [j for j in self._jobs.values() if chat_id is None or j.chat_id == chat_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def kill(self, job_id):
+        """Cancela el trabajo: runner.run termina todo su grupo de procesos."""
+        job = self.get(job_id)
+        if job is None or not job.running:
+            return False
+        job.cancel.set()
+        return True
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Mensaje de Telegram "en vivo": se envía con el primer texto disponible y
+después se va editando a medida que llega más, con un límite de ediciones por
+segundo para no chocar con los límites de la Bot API.
+
+Con overflow="split" el texto que no entra en un mensaje sigue en mensajes
+nuevos (respuestas de la IA); con "tail" se muestra sólo el final (salida de
+comandos, donde importa lo más reciente).
+"""
+import logging
+import threading
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+# Límite de caracteres de un mensaje de Telegram
+TELEGRAM_MAX_CHARS = 4096
+
+
+def split_point(text, max_chars):
+    """Dónde cortar text para que el primer trozo entre en max_chars (en un salto de línea o espacio si se puede)."""
+    for separator in ("\n", " "):
+        cut = text.rfind(separator, 0, max_chars) + 1
+        if cut > max_chars // 2:
+            return cut
+    return max_chars
+
+
+class LiveMessage:
+    """
+    Acumula texto con append() y lo refleja en un mensaje. Si el texto no
+    entra en un mensaje, según overflow se muestra sólo el final ("tail") o
+    se continúa en mensajes nuevos ("split").
+
+    El primer fragmento se envía enseguida (o, con placeholder, se envía el
+    placeholder al crear el objeto y el primer fragmento lo reemplaza); a
+    partir de ahí un hilo aparte edita el mensaje como mucho cada
+    min_interval segundos. Con first_delay el primer envío espera esos
+    segundos: si todo termina antes, sale un solo mensaje con el texto final
+    en lugar de un envío y una edición.
+    """
+
+    def __init__(self, bot, chat_id, reply_to=None, min_interval=1.5, max_chars=TELEGRAM_MAX_CHARS,
+                 overflow="tail", placeholder=None, first_delay=0):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.reply_to = reply_to
+        self.min_interval = min_interval
+        self.max_chars = max_chars
+        self.overflow = overflow
+        self.placeholder = placeholder
+        self.message_id = None
+        self.message_ids = []  # todos los mensajes enviados (más de uno con "split")
+        self._text = ""
+        self._start = 0  # comienzo en _text del mensaje actual (lo anterior ya quedó en otros)
+        self._shown = ""
+        self._next_edit = 0.0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        if placeholder:
+            with self._lock:
+                self._show(placeholder, time.monotonic())
+                self._next_edit = 0.0  # el primer texto real reemplaza al placeholder sin esperar
+        elif first_delay:
+            self._next_edit = time.monotonic() + first_delay
+        self._thread = threading.Thread(target=self._run, name=f"live-{chat_id}", daemon=True)
+        self._thread.start()
+
+    def append(self, text):
+        if not text:
+            return
+        with self._lock:
+            self._text += text
+            first = self.message_id is None or self._shown == self.placeholder
+        if first:
+            self.flush()
+
+    def set_text(self, text):
+        """Reemplaza el texto acumulado (p.ej. por la respuesta final completa)."""
+        with self._lock:
+            self._text = text
+            self._start = min(self._start, len(text))
+
+    def _render(self, text):
+        text = text.strip() or "…"
+        if len(text) > self.max_chars:
+            text = "…" + text[-(self.max_chars - 1):]
+        return text
+
+    def flush(self, force=False):
+        with self._lock:
+            now = time.monotonic()
+            if self.overflow == "split" and not self._split(now, force):
+                return
+            current = self._text[self._start:]
+            if not current.strip():
+                return
+            if not force and now < self._next_edit:
+                return
+            rendered = self._render(current)
+            if rendered == self._shown:
+                return
+            self._show(rendered, now)
+
+    def _split(self, now, force):
+        """Cierra los mensajes llenos y sigue en uno nuevo. False si hay que reintentar más tarde."""
+        while len(self._text) - self._start > self.max_chars:
+            if not force and now < self._next_edit:
+                return False
+            cut = split_point(self._text[self._start:], self.max_chars)
+            if not self._show(self._text[self._start:self._start + cut].strip() or "…", now):
+                return False
+            self._start += cut
+            self.message_id = None
+            self._shown = ""
+        return True
+
+    def _show(self, rendered, now):
+        """Envía o edita el mensaje actual. Debe llamarse con _lock tomado."""
+        try:
+            if self.message_id is None:
+                reply_to = self.reply_to if not self.message_ids else None
+                sent = self.bot.send_message(self.chat_id, rendered,
+                                             reply_to_message_id=getattr(reply_to, "message_id", None))
+                self.message_id = sent.message_id
+                self.message_ids.append(sent.message_id)
+            else:
+                self.bot.edit_message_text(rendered, self.chat_id, self.message_id)
+            self._shown = rendered
+            self._next_edit = now + self.min_interval
+            return True
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                # Demasiadas ediciones: respetamos el retry_after que indica Telegram
+                retry_after = e.result_json.get("parameters", {}).get("retry_after", 5)
+                self._next_edit = now + retry_after
+            elif "message is not modified" in e.description:
+                self._shown = rendered
+                return True
+            else:
+                logging.warning(f"Error updating live message in {self.chat_id}: {e}")
+                self._next_edit = now + self.min_interval
+            return False
+
+    def _run(self):
+        # Con first_delay corto hay que mirar seguido hasta el primer envío
+        while not self._stopped.wait(min(self.min_interval / 2, max(self._next_edit - time.monotonic(), 0.05))):
+            self.flush()
+
+    def _pending(self):
+        """True si flush(force=True) tendría algo que mostrar. Debe llamarse con _lock tomado."""
+        current = self._text[self._start:]
+        if self.overflow == "split" and len(current) > self.max_chars:
+            return True
+        return bool(current.strip()) and self._render(current) != self._shown
+
+    def finish(self, footer=None):
+        """
+        Detiene las ediciones periódicas y deja el mensaje con el texto final.
+        No bloquea: si la última edición tiene que esperar el intervalo
+        mínimo, queda programada en un Timer.
+        """
+        self._stopped.set()
+        self._thread.join()
+        with self._lock:
+            if footer:
+                self._text = self._text.rstrip() + "\n\n" + footer if self._text.strip() else footer
+            wait = self._next_edit - time.monotonic()
+            # Sin mensaje todavía la última "edición" es un envío; sin cambios no hay nada que esperar
+            if self.message_id is None or not self._pending():
+                wait = 0
+        if wait > 0:
+            timer = threading.Timer(wait, self._finish)
+            timer.daemon = True
+            timer.start()
+        else:
+            self._finish()
+
+    def _finish(self):
+        self.flush(force=True)
+        if self.placeholder and self._shown == self.placeholder:
+            # No llegó ningún texto: no dejamos el placeholder colgado
+            try:
+                self.bot.delete_message(self.chat_id, self.message_id)
+            except ApiTelegramException as e:
+                logging.warning(f"Error deleting placeholder in {self.chat_id}: {e}")
+
+    @property
+    def text(self):
+        with self._lock:
+            return self._text
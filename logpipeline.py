@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Logging sin bloquear: los handlers del bot sólo encolan el registro y un hilo
+aparte lo escribe en disco (QueueHandler + QueueListener), así la latencia de
+un comando no depende de la escritura ni de la rotación del log.
+
+Los mensajes se recortan a un máximo de bytes antes de encolarlos (las
+salidas de `sys` o las respuestas de la IA pueden ser enormes) y se puede
+elegir un formato JSON-lines con campos de tiempo por registro.
+"""
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+
+def cap_payload(text, max_bytes):
+    """Recorta text a max_bytes (UTF-8) indicando cuántos bytes se omitieron."""
+    encoded = text.encode('utf-8')
+    if not max_bytes or len(encoded) <= max_bytes:
+        return text
+    head = encoded[:max_bytes].decode('utf-8', 'ignore')
+    return f"{head}… [+{len(encoded) - max_bytes} bytes]"
+
+
+class CappingQueueHandler(QueueHandler):
+    """
+    Encola registros ya recortados. Si la cola está llena (el disco no da
+    abasto) el registro se descarta y se cuenta, en lugar de bloquear.
+    """
+
+    def __init__(self, log_queue, max_payload):
+        super().__init__(log_queue)
+        self.max_payload = max_payload
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        message = record.getMessage()
+        record.payload_bytes = len(message.encode('utf-8'))
+        record.msg = cap_payload(message, self.max_payload)
+        record.args = None
+        if record.exc_info:
+            # El traceback se formatea acá: el objeto de excepción no viaja por la cola
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con tiempos de creación y de espera en cola."""
+
+    def format(self, record):
+        written = time.time()
+        data = {
+            "ts": record.created,
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+            "payload_bytes": getattr(record, "payload_bytes", None),
+            "uptime_ms": round(record.relativeCreated, 1),
+            "queue_ms": round((written - record.created) * 1000, 3),
+        }
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class LogPipeline:
+    def __init__(self, handler, listener):
+        self.handler = handler
+        self.listener = listener
+
+    @property
+    def dropped(self):
+        return self.handler.dropped
+
+    def stop(self):
+        """
+        Escribe lo que quede en la cola y detiene el hilo escritor. Si se
+        descartaron registros lo deja dicho en el log, directo al archivo.
+        """
+        if self.listener._thread is not None:
+            self.listener.stop()
+            if self.dropped:
+                record = logging.makeLogRecord({
+                    "name": "logpipeline", "levelno": logging.WARNING, "levelname": "WARNING",
+                    "msg": f"{self.dropped} log records dropped because the log queue was full",
+                })
+                for handler in self.listener.handlers:
+                    handler.handle(record)
+
+
+def setup(log_file, level="INFO", max_bytes=1048576, backup_count=5,
+          max_payload=2048, fmt="text", queue_size=10000):
+    """
+    Configura el logger raíz para escribir en log_file desde un hilo aparte.
+    Devuelve el LogPipeline (se detiene y vacía la cola al salir del proceso).
+    """
+    file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = CappingQueueHandler(log_queue, max_payload)
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+
+    logging.basicConfig(level=level, handlers=[queue_handler], force=True)
+    pipeline = LogPipeline(queue_handler, listener)
+    atexit.register(pipeline.stop)
+    return pipeline
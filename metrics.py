@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Métricas de latencia por etapa, en memoria.
+
+Cada etapa (descarga de la nota de voz, transcripción, ask_ai, envío...)
+acumula un histograma con cubetas fijas (lo que exporta Prometheus) y las
+últimas muestras, de las que salen p50/p95/p99 para el comando `stats`.
+Opcionalmente se escriben en un archivo .prom para el textfile collector de
+node_exporter.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Límites superiores de las cubetas, en segundos
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogram:
+    def __init__(self, window=1024):
+        self.count = 0
+        self.errors = 0
+        self.sum = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds, error=False):
+        self.count += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        self.recent.append(seconds)
+
+    def quantiles(self, qs=(0.5, 0.95, 0.99)):
+        samples = sorted(self.recent)
+        if not samples:
+            return {q: None for q in qs}
+        return {q: samples[min(int(q * len(samples)), len(samples) - 1)] for q in qs}
+
+
+class Metrics:
+    """
+    Registro de histogramas por etapa. Con textfile, un hilo reescribe el
+    archivo cada write_interval segundos (de forma atómica, como pide el
+    textfile collector).
+    """
+
+    def __init__(self, textfile=None, prefix="telegrambot", write_interval=15):
+        self.textfile = textfile
+        self.prefix = prefix
+        self.started = time.time()
+        self._stages = {}
+        self._counters = {}  # nombre -> función que devuelve el valor actual
+        self._lock = threading.Lock()
+        if textfile:
+            threading.Thread(target=self._writer, args=(write_interval,), name="metrics-writer", daemon=True).start()
+
+    def observe(self, stage, seconds, error=False):
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram()
+            histogram.observe(seconds, error)
+
+    def counter(self, name, read):
+        """Registra un contador que lleva otro módulo; read() devuelve su valor."""
+        with self._lock:
+            self._counters[name] = read
+
+    def counters(self):
+        with self._lock:
+            counters = dict(self._counters)
+        return {name: read() for name, read in sorted(counters.items())}
+
+    @contextmanager
+    def timer(self, stage):
+        """Mide el bloque; si lanza una excepción cuenta como error."""
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException:
+            self.observe(stage, time.monotonic() - start, error=True)
+            raise
+        self.observe(stage, time.monotonic() - start)
+
+    def snapshot(self):
+        with self._lock:
+            return {stage: {
+                "count": h.count,
+                "errors": h.errors,
+                "sum": h.sum,
+                "buckets": list(h.buckets),
+                "quantiles": h.quantiles(),
+            } for stage, h in self._stages.items()}
+
+    def summary(self):
+        """Texto para el chat: etapas ordenadas por tiempo total acumulado."""
+        stages = self.snapshot()
+        counters = self.counters()
+        if not stages and not any(counters.values()):
+            return "Sin métricas todavía."
+        uptime = time.time() - self.started
+        lines = [f"Métricas desde hace {uptime / 60:.0f} min (p50 / p95 / p99, n, errores, total):"]
+        for stage, data in sorted(stages.items(), key=lambda item: -item[1]["sum"]):
+            q = data["quantiles"]
+            lines.append(f"{stage}: {q[0.5]:.2f}s / {q[0.95]:.2f}s / {q[0.99]:.2f}s, "
+                         f"n={data['count']}, err={data['errors']}, {data['sum']:.1f}s")
+        lines += [f"{name}: {value}" for name, value in counters.items()]
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """Formato de exposición de texto de Prometheus."""
+        name = f"{self.prefix}_stage_seconds"
+        lines = [f"# HELP {name} Duración de cada etapa del bot.", f"# TYPE {name} histogram"]
+        stages = sorted(self.snapshot().items())
+        for stage, data in stages:
+            cumulative = 0
+            for bound, count in zip(BUCKETS, data["buckets"]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {data["count"]}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {data["sum"]:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {data["count"]}')
+        errors = f"{self.prefix}_stage_errors_total"
+        lines += [f"# HELP {errors} Etapas que terminaron con una excepción.", f"# TYPE {errors} counter"]
+        for stage, data in stages:
+            lines.append(f'{errors}{{stage="{stage}"}} {data["errors"]}')
+        recent = f"{self.prefix}_stage_recent_seconds"
+        lines += [f"# HELP {recent} Cuantiles de las últimas muestras de cada etapa.", f"# TYPE {recent} gauge"]
+        for stage, data in stages:
+            for q, value in data["quantiles"].items():
+                if value is not None:
+                    lines.append(f'{recent}{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+        for counter, value in self.counters().items():
+            counter = f"{self.prefix}_{counter}_total"
+            lines += [f"# TYPE {counter} counter", f"{counter} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self):
+        tmp = f"{self.textfile}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(tmp, self.textfile)
+
+    def _writer(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.write_textfile()
+            except OSError as e:
+                logging.error(f"Error escribiendo métricas en {self.textfile}: {str(e)}")
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Entrega de salidas largas (sys, sudo, ask_ai...) sin recortarlas.
+
+Hasta un umbral se parten en varios mensajes por límites de línea; por encima
+se envía la salida completa como .txt.gz y se guardan las páginas para
+recorrerlas con el comando "more".
+"""
+import gzip
+import io
+import logging
+import threading
+
+from livemessage import TELEGRAM_MAX_CHARS
+
+
+def split_message(text, max_chars=TELEGRAM_MAX_CHARS):
+    """Parte text en trozos de hasta max_chars, cortando en saltos de línea."""
+    pages = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > max_chars:
+            # Línea más larga que un mensaje: no queda otra que cortarla
+            if current:
+                pages.append(current)
+                current = ""
+            pages.append(line[:max_chars])
+            line = line[max_chars:]
+        if len(current) + len(line) > max_chars:
+            pages.append(current)
+            current = ""
+        current += line
+    if current:
+        pages.append(current)
+    return [p for p in pages if p.strip()] or [text[:max_chars]]
+
+
+class OutputDelivery:
+    """
+    Envía textos de cualquier tamaño a un chat. Recuerda, por chat, las páginas
+    de la última salida enviada como documento para el comando "more".
+    """
+
+    def __init__(self, bot, document_threshold=12000, page_chars=TELEGRAM_MAX_CHARS - 96):
+        self.bot = bot
+        self.document_threshold = document_threshold
+        self.page_chars = page_chars
+        self._pages = {}  # chat_id -> [páginas, próxima página]
+        self._lock = threading.Lock()
+
+    def deliver(self, chat_id, text, reply_to=None, name="output"):
+        if not text:
+            return
+        if len(text) > self.document_threshold:
+            self.send_document(chat_id, text, reply_to=reply_to, name=name)
+            self.more(chat_id)
+            return
+        for i, page in enumerate(split_message(text, TELEGRAM_MAX_CHARS)):
+            if i == 0 and reply_to is not None:
+                self.bot.reply_to(reply_to, page)
+            else:
+                self.bot.send_message(chat_id, page)
+
+    def send_document(self, chat_id, text, reply_to=None, name="output"):
+        """Envía text comprimido como <name>.txt.gz y guarda sus páginas para "more"."""
+        document = io.BytesIO(gzip.compress(text.encode('utf-8')))
+        document.name = f"{name}.txt.gz"
+        pages = split_message(text, self.page_chars)
+        with self._lock:
+            self._pages[chat_id] = [pages, 0]
+        logging.info(f"Sending document to {chat_id}: {document.name} ({len(text)} chars, {len(pages)} pages)")
+        self.bot.send_document(chat_id, document,
+                               reply_to_message_id=getattr(reply_to, "message_id", None),
+                               caption=f"Salida completa: {len(text)} caracteres, {len(pages)} páginas. Use 'more' para verla por partes.")
+
+    def more(self, chat_id):
+        """Envía la siguiente página de la última salida larga del chat."""
+        with self._lock:
+            entry = self._pages.get(chat_id)
+            if entry is None:
+                page = None
+            else:
+                pages, index = entry
+                page = f"[{index + 1}/{len(pages)}]\n{pages[index]}"
+                if index + 1 < len(pages):
+                    entry[1] += 1
+                else:
+                    del self._pages[chat_id]
+        self.bot.send_message(chat_id, page or "No hay más salida.")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Ruteo de comandos de chat y expansión de aliases.
+
+Los comandos se indexan por su primera palabra, así que encontrar el handler
+de un mensaje es una búsqueda en un dict, sin importar cuántos comandos haya.
+"""
+import threading
+
+
+class CommandRouter:
+    """
+    Tabla de comandos. Un comando `exact` sólo coincide si el mensaje es
+    exactamente su nombre; uno `prefix` coincide con "<nombre> <argumentos>"
+    (el nombre puede tener varias palabras, p.ej. "describe alias").
+
+    Los handlers reciben (message, args), donde args es el texto que sigue al
+    nombre. Si un handler devuelve False se considera que no manejó el mensaje.
+    """
+
+    def __init__(self):
+        self._exact = {}   # nombre -> (handler, auth)
+        self._prefix = {}  # primera palabra -> [(nombre, handler, auth)], nombres más largos primero
+
+    def exact(self, *names, auth=True):
+        def register(handler):
+            for name in names:
+                self._exact[name.lower()] = (handler, auth)
+            return handler
+        return register
+
+    def prefix(self, *names, auth=True):
+        def register(handler):
+            for name in names:
+                name = name.lower()
+                entries = self._prefix.setdefault(name.split()[0], [])
+                entries.append((name, handler, auth))
+                entries.sort(key=lambda entry: -len(entry[0]))
+            return handler
+        return register
+
+    def match(self, text):
+        """Devuelve (handler, args, auth) para text, o (None, None, None)."""
+        text = text.strip()
+        lower = text.lower()
+        if lower in self._exact:
+            handler, auth = self._exact[lower]
+            return handler, "", auth
+        first = lower.split(None, 1)[0] if lower else ""
+        for name, handler, auth in self._prefix.get(first, ()):
+            if lower.startswith(name + " "):
+                return handler, text[len(name) + 1:], auth
+        return None, None, None
+
+    def names(self):
+        return sorted(set(self._exact) | {name for entries in self._prefix.values() for name, _, _ in entries})
+
+
+class AliasCycleError(ValueError):
+    pass
+
+
+class AliasResolver:
+    """
+    Expande aliases de forma recursiva (un alias puede apuntar a otro), con
+    detección de ciclos. tables() debe devolver (version, [tabla, ...]); las
+    tablas se consultan en orden y la versión debe cambiar cada vez que se
+    modifica alguna. Las expansiones se memorizan mientras no cambie la versión.
+    """
+
+    def __init__(self, tables, max_depth=16, cache_size=512):
+        self.tables = tables
+        self.max_depth = max_depth
+        self.cache_size = cache_size
+        self._cache = {}
+        self._cache_version = None
+        self._lock = threading.Lock()
+
+    def _lookup(self, tables, name):
+        for table in tables:
+            if name in table:
+                return table[name].get('command', '')
+        return None
+
+    def expand(self, text):
+        version, tables = self.tables()
+        with self._lock:
+            if version != self._cache_version:
+                self._cache = {}
+                self._cache_version = version
+            if text in self._cache:
+                return self._cache[text]
+
+        result = text
+        seen = []
+        while True:
+            tokens = result.strip().split()
+            if not tokens:
+                break
+            name = tokens[0].lower()
+            replacement = self._lookup(tables, name)
+            if replacement is None:
+                break
+            if name in seen:
+                raise AliasCycleError(f"Ciclo de aliases: {' -> '.join(seen + [name])}")
+            if len(seen) >= self.max_depth:
+                raise AliasCycleError(f"Demasiados aliases anidados: {' -> '.join(seen)}")
+            seen.append(name)
+            args = tokens[1:]
+            # Reemplazar '${*}' por los argumentos, o agregarlos al final
+            if '${*}' in replacement:
+                result = replacement.replace('${*}', ' '.join(args))
+            else:
+                result = replacement
+                if args:
+                    result += ' ' + ' '.join(args)
+            result = result.strip()
+
+        with self._lock:
+            if self._cache_version == version:
+                if len(self._cache) >= self.cache_size:
+                    self._cache.pop(next(iter(self._cache)))
+                self._cache[text] = result
+        return result
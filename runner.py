@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Ejecución acotada de comandos de shell.
+
+Todas las llamadas a la shell del bot pasan por run(), que impone un tiempo
+máximo, un tope de bytes de salida y, opcionalmente, límites de CPU y memoria.
+El comando corre en su propio grupo de procesos, así que al vencer un límite
+o al cancelarlo se mata también a todos sus hijos (pipes incluidos).
+"""
+import codecs
+import os
+import select
+import signal
+import subprocess
+import time
+
+DEFAULT_TIMEOUT = float(os.getenv('RUN_TIMEOUT', '300'))
+DEFAULT_MAX_BYTES = int(os.getenv('RUN_MAX_BYTES', str(1024 * 1024)))
+DEFAULT_CPU_SECONDS = int(os.getenv('RUN_CPU_SECONDS', '0'))  # 0 = sin límite
+DEFAULT_MEMORY_BYTES = int(os.getenv('RUN_MEMORY_BYTES', '0'))  # 0 = sin límite
+
+
+class RunResult:
+    def __init__(self, output, returncode, elapsed, timed_out=False, truncated=False, cancelled=False):
+        self.output = output
+        self.returncode = returncode
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+        self.truncated = truncated
+        self.cancelled = cancelled
+
+    def notes(self):
+        """Aviso para el usuario si el comando se cortó por algún límite."""
+        if self.timed_out:
+            return f"[Tiempo agotado: comando terminado tras {self.elapsed:.0f}s]"
+        if self.truncated:
+            return "[Salida demasiado grande: comando terminado]"
+        if self.cancelled:
+            return "[Comando cancelado]"
+        return ""
+
+    def text(self, empty="Done."):
+        """Salida más avisos, o `empty` si el comando no imprimió nada."""
+        text = self.output
+        notes = self.notes()
+        if notes:
+            text = (text.rstrip() + "\n\n" + notes) if text.strip() else notes
+        return text or empty
+
+
+def _limits(cpu_seconds, memory_bytes):
+    """
+    Prefijo de shell que fija los rlimits antes de ejecutar el comando (los
+    hereda todo lo que lance). Va en la shell y no en un preexec_fn, que no es
+    seguro en un proceso con hilos.
+    """
+    limits = []
+    if cpu_seconds:
+        limits.append(f"ulimit -t {int(cpu_seconds)}")
+    if memory_bytes:
+        limits.append(f"ulimit -v {max(1, int(memory_bytes) // 1024)}")  # en KiB
+    return "".join(f"{limit} || exit 126\n" for limit in limits)
+
+
+def kill_group(proc, grace=2.0):
+    """SIGTERM a todo el grupo de procesos y, si no alcanza, SIGKILL."""
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        proc.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        proc.wait()
+
+
+def run(cmd, timeout=DEFAULT_TIMEOUT, max_bytes=DEFAULT_MAX_BYTES,
+        cpu_seconds=DEFAULT_CPU_SECONDS, memory_bytes=DEFAULT_MEMORY_BYTES,
+        input=None, on_output=None, cancel=None, capture=True):
+    """
+    Ejecuta cmd en la shell (stderr mezclado con stdout) y devuelve un RunResult.
+
+    - timeout: segundos de reloj (None = sin límite).
+    - max_bytes: tope de bytes leídos; al superarlo se mata el comando (None = sin tope).
+    - cpu_seconds / memory_bytes: rlimits de CPU y espacio de direcciones (0 = sin límite).
+    - input: texto que se escribe en stdin (p.ej. la contraseña de sudo).
+    - on_output(texto): se llama con cada fragmento de salida a medida que llega.
+    - cancel: threading.Event; si se activa se mata el grupo de procesos.
+    - capture: si es False no se acumula la salida (sólo se entrega a on_output).
+    """
+    start = time.monotonic()
+    proc = subprocess.Popen(
+        _limits(cpu_seconds, memory_bytes) + cmd + " 2>&1", shell=True,
+        stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        start_new_session=True,
+    )
+    if input is not None:
+        try:
+            proc.stdin.write(input.encode('utf-8'))
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    chunks = []
+    read = 0
+    timed_out = truncated = cancelled = False
+    fd = proc.stdout.fileno()
+    while True:
+        if cancel is not None and cancel.is_set():
+            cancelled = True
+            break
+        wait = 0.5
+        if timeout is not None:
+            remaining = timeout - (time.monotonic() - start)
+            if remaining <= 0:
+                timed_out = True
+                break
+            wait = min(wait, remaining)
+        ready, _, _ = select.select([fd], [], [], wait)
+        if not ready:
+            continue
+        data = os.read(fd, 65536)
+        if not data:
+            break
+        if max_bytes is not None and read + len(data) > max_bytes:
+            data = data[:max_bytes - read]
+            truncated = True
+        read += len(data)
+        text = decoder.decode(data)
+        if capture:
+            chunks.append(text)
+        if on_output and text:
+            on_output(text)
+        if truncated:
+            break
+
+    if timed_out or truncated or cancelled:
+        kill_group(proc)
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        if capture:
+            chunks.append(tail)
+        if on_output:
+            on_output(tail)
+    proc.stdout.close()
+    try:
+        # La salida puede cerrarse antes de que el proceso termine
+        remaining = None if timeout is None else max(timeout - (time.monotonic() - start), 0.1)
+        returncode = proc.wait(timeout=remaining)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        kill_group(proc)
+        returncode = proc.wait()
+    return RunResult("".join(chunks), returncode, time.monotonic() - start,
+                     timed_out=timed_out, truncated=truncated, cancelled=cancelled)
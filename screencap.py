@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Captura de pantalla en memoria para el comando `screen`.
+
+Con mss y Pillow instalados se lee el framebuffer de X en el propio proceso
+(con XShm si está disponible), se recorta y achica si hace falta y se
+codifica a JPEG en un BytesIO, sin archivos intermedios. Si faltan, se usa
+un solo `import` de ImageMagick que escribe el JPEG por stdout.
+
+Uso suelto: python screencap.py [salida.jpg] (con DISPLAY apuntando al servidor X)
+"""
+import io
+import os
+import subprocess
+import sys
+import threading
+
+QUALITY = int(os.getenv("SCREEN_QUALITY", "80"))
+# Ancho máximo de la imagen enviada (0 = tamaño original); Telegram la recomprime igual
+MAX_WIDTH = int(os.getenv("SCREEN_MAX_WIDTH", "1920"))
+# Zona a capturar como en ImageMagick, <ancho>x<alto>+<x>+<y> (vacío = pantalla completa)
+CROP = os.getenv("SCREEN_CROP", "")
+TIMEOUT = 60
+
+try:
+    import mss
+    from PIL import Image
+except ImportError:  # sin captura en proceso: se usa ImageMagick
+    mss = None
+
+# Una conexión a X por hilo y display (los objetos de mss no se comparten entre hilos)
+_local = threading.local()
+
+
+def parse_geometry(geometry):
+    """'<ancho>x<alto>+<x>+<y>' -> (x, y, ancho, alto), o None si está vacía."""
+    if not geometry:
+        return None
+    size, _, offset = geometry.partition("+")
+    width, height = (int(n) for n in size.lower().split("x"))
+    x, _, y = offset.partition("+")
+    return int(x or 0), int(y or 0), width, height
+
+
+def _grabber(display):
+    grabbers = getattr(_local, "grabbers", None)
+    if grabbers is None:
+        grabbers = _local.grabbers = {}
+    grabber = grabbers.get(display)
+    if grabber is None:
+        grabber = grabbers[display] = mss.mss(display=display)
+    return grabber
+
+
+def grab(display=None, crop=None):
+    """Imagen PIL (RGB) de la pantalla completa o de la zona crop=(x, y, ancho, alto)."""
+    grabber = _grabber(display)
+    if crop is None:
+        monitor = grabber.monitors[0]  # todos los monitores juntos
+    else:
+        x, y, width, height = crop
+        monitor = {"left": x, "top": y, "width": width, "height": height}
+    try:
+        shot = grabber.grab(monitor)
+    except mss.exception.ScreenShotError:
+        # La conexión pudo quedar inválida (p.ej. se reinició X): reconectamos una vez
+        _local.grabbers.pop(display, None)
+        shot = _grabber(display).grab(monitor)
+    return Image.frombytes("RGB", shot.size, shot.bgra, "raw", "BGRX")
+
+
+def encode(image, max_width=MAX_WIDTH, quality=QUALITY):
+    """Achica image a max_width (si es más ancha) y la codifica a JPEG en un BytesIO."""
+    if max_width and image.width > max_width:
+        height = round(image.height * max_width / image.width)
+        # reducing_gap: primero reduce por un factor entero (rápido) y después interpola
+        image = image.resize((max_width, height), Image.BILINEAR, reducing_gap=2.0)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    buffer.seek(0)
+    return buffer
+
+
+def capture_imagemagick(display=None, crop=None, max_width=MAX_WIDTH, quality=QUALITY):
+    """Respaldo sin mss/Pillow: un solo `import` que escribe el JPEG en stdout."""
+    cmd = ["import", "-silent", "-window", "root"]
+    if crop is not None:
+        x, y, width, height = crop
+        cmd += ["-crop", f"{width}x{height}+{x}+{y}"]
+    if max_width:
+        cmd += ["-resize", f"{max_width}>"]
+    cmd += ["-quality", str(quality), "jpg:-"]
+    env = dict(os.environ, DISPLAY=display) if display else None
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, timeout=TIMEOUT, check=False)
+    if result.returncode != 0 or not result.stdout:
+        raise RuntimeError(f"import falló ({result.returncode}): {result.stderr.decode('utf-8', 'replace').strip()}")
+    return io.BytesIO(result.stdout)
+
+
+def capture(display=None, crop=CROP, max_width=MAX_WIDTH, quality=QUALITY):
+    """
+    Captura la pantalla de display (por defecto $DISPLAY) y devuelve un
+    BytesIO con el JPEG, listo para bot.send_photo.
+    """
+    region = parse_geometry(crop) if isinstance(crop, str) else crop
+    if mss is not None:
+        photo = encode(grab(display, region), max_width, quality)
+    else:
+        photo = capture_imagemagick(display, region, max_width, quality)
+    photo.name = "screen.jpg"
+    return photo
+
+
+def main():
+    output = sys.argv[1] if len(sys.argv) > 1 else "screen.jpg"
+    photo = capture()
+    with open(output, "wb") as f:
+        f.write(photo.getvalue())
+    backend = "mss + Pillow" if mss is not None else "ImageMagick"
+    print(f"{output}: {len(photo.getvalue())} bytes ({backend})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Estado compartido entre bot.py, botsend.py y tospeech.py en una base SQLite.
+
+La base está en modo WAL: los lectores (las herramientas de línea de
+comandos) no bloquean las escrituras del bot ni al revés, y varios procesos
+pueden usarla a la vez. Cada hilo abre su propia conexión.
+
+Guarda:
+- sesiones: chats autorizados, con vencimiento opcional (TTL);
+- aliases de usuario (ver aliasstore.py);
+- file_ids de Telegram de archivos ya subidos (ver botsend.py);
+- índice y contadores del cache de audios de tospeech.py.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+STATE_DB = os.getenv('STATE_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state.db'))
+# Segundos que se espera a que otro proceso libere la base antes de fallar
+BUSY_TIMEOUT = float(os.getenv('STATE_BUSY_TIMEOUT', '5'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    chat_id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    expires REAL
+);
+CREATE TABLE IF NOT EXISTS aliases (
+    name TEXT PRIMARY KEY,
+    command TEXT NOT NULL,
+    description TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS file_ids (
+    kind TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    PRIMARY KEY (kind, digest)
+);
+CREATE TABLE IF NOT EXISTS tts_cache (
+    name TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tts_cache_last_used ON tts_cache (last_used);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class StateStore:
+    def __init__(self, path=STATE_DB, timeout=BUSY_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._db().executescript(SCHEMA)
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # isolation_level=None: las transacciones las abrimos nosotros
+            db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE: toma el lock de escritura al empezar, no a mitad."""
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def query(self, sql, params=()):
+        return self._db().execute(sql, params).fetchall()
+
+    # --- Metadatos ---
+
+    def get_meta(self, key, default=None):
+        rows = self.query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else default
+
+    def set_meta(self, key, value, db=None):
+        sql = "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)"
+        if db is not None:
+            db.execute(sql, (key, value))
+            return
+        with self.transaction() as db:
+            db.execute(sql, (key, value))
+
+    # --- Sesiones ---
+
+    def authorize(self, chat_id, ttl=None):
+        """Autoriza chat_id; con ttl (segundos) la sesión vence sola."""
+        now = time.time()
+        expires = now + ttl if ttl else None
+        with self.transaction() as db:
+            db.execute("INSERT OR REPLACE INTO sessions (chat_id, created, expires) VALUES (?, ?, ?)",
+                       (chat_id, now, expires))
+
+    def revoke(self, chat_id):
+        with self.transaction() as db:
+            return db.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,)).rowcount > 0
+
+    def revoke_all(self):
+        with self.transaction() as db:
+            db.execute("DELETE FROM sessions")
+
+    def is_authorized(self, chat_id):
+        rows = self.query("SELECT 1 FROM sessions WHERE chat_id = ? AND (expires IS NULL OR expires > ?)",
+                          (chat_id, time.time()))
+        return bool(rows)
+
+    def sessions(self):
+        """Chats con sesión vigente, en orden de login."""
+        rows = self.query("SELECT chat_id FROM sessions WHERE expires IS NULL OR expires > ? ORDER BY created",
+                          (time.time(),))
+        return [chat_id for chat_id, in rows]
+
+    def purge_expired(self):
+        with self.transaction() as db:
+            return db.execute("DELETE FROM sessions WHERE expires <= ?", (time.time(),)).rowcount
+
+    def import_chat_ids_file(self, path="last_admin_chat_ids", ttl=None):
+        """Migra (una sola vez) los chats del viejo archivo last_admin_chat_ids."""
+        if self.get_meta('chat_ids_imported') or not os.path.exists(path):
+            return
+        with open(path, "r") as f:
+            ids = [int(i) for i in f.read().split(',') if i.strip()]
+        for chat_id in ids:
+            self.authorize(chat_id, ttl)
+        self.set_meta('chat_ids_imported', '1')
+
+    # --- Aliases de usuario ---
+
+    def aliases(self):
+        rows = self.query("SELECT name, command, description FROM aliases ORDER BY rowid")
+        return {name: {'command': command, 'description': description} for name, command, description in rows}
+
+    def aliases_revision(self):
+        """Cambia con cada escritura de aliases (de cualquier proceso)."""
+        return int(self.get_meta('aliases_rev', '0'))
+
+    def _bump_aliases(self, db):
+        db.execute("INSERT INTO meta (key, value) VALUES ('aliases_rev', 1) "
+                   "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+
+    def set_alias(self, name, command, description=None):
+        """Crea o actualiza un alias; con description=None conserva la que tenía."""
+        with self.transaction() as db:
+            if description is None:
+                row = db.execute("SELECT description FROM aliases WHERE name = ?", (name,)).fetchone()
+                description = row[0] if row else ''
+            db.execute("INSERT INTO aliases (name, command, description) VALUES (?, ?, ?) "
+                       "ON CONFLICT(name) DO UPDATE SET command = excluded.command, description = excluded.description",
+                       (name, command, description))
+            self._bump_aliases(db)
+
+    def describe_alias(self, name, description):
+        with self.transaction() as db:
+            updated = db.execute("UPDATE aliases SET description = ? WHERE name = ?",
+                                 (description, name)).rowcount > 0
+            if updated:
+                self._bump_aliases(db)
+            return updated
+
+    def replace_aliases(self, aliases, meta=None):
+        """Reemplaza todos los aliases (y opcionalmente metadatos) en una sola transacción."""
+        with self.transaction() as db:
+            db.execute("DELETE FROM aliases")
+            db.executemany("INSERT INTO aliases (name, command, description) VALUES (?, ?, ?)",
+                           [(name, data.get('command', ''), data.get('description', ''))
+                            for name, data in aliases.items()])
+            self._bump_aliases(db)
+            for key, value in (meta or {}).items():
+                self.set_meta(key, value, db)
+
+    # --- file_ids de Telegram ---
+
+    def get_file_id(self, digest, kind):
+        rows = self.query("SELECT file_id FROM file_ids WHERE kind = ? AND digest = ?", (kind, digest))
+        return rows[0][0] if rows else None
+
+    def put_file_id(self, digest, kind, file_id):
+        with self.transaction() as db:
+            db.execute("INSERT OR REPLACE INTO file_ids (kind, digest, file_id) VALUES (?, ?, ?)",
+                       (kind, digest, file_id))
+
+    def discard_file_id(self, digest, kind):
+        with self.transaction() as db:
+            db.execute("DELETE FROM file_ids WHERE kind = ? AND digest = ?", (kind, digest))
+
+    # --- Cache de audios ---
+
+    def tts_touch(self, name):
+        """Marca una entrada como usada. False si no estaba en el índice."""
+        with self.transaction() as db:
+            return db.execute("UPDATE tts_cache SET last_used = ? WHERE name = ?",
+                              (time.time(), name)).rowcount > 0
+
+    def tts_put(self, name, size):
+        with self.transaction() as db:
+            db.execute("INSERT OR REPLACE INTO tts_cache (name, bytes, last_used) VALUES (?, ?, ?)",
+                       (name, size, time.time()))
+
+    def tts_forget(self, names):
+        with self.transaction() as db:
+            db.executemany("DELETE FROM tts_cache WHERE name = ?", [(name,) for name in names])
+
+    def tts_usage(self):
+        """(entradas, bytes) del cache."""
+        count, total = self.query("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM tts_cache")[0]
+        return count, total
+
+    def tts_oldest(self, limit):
+        return self.query("SELECT name, bytes FROM tts_cache ORDER BY last_used LIMIT ?", (limit,))
+
+    # --- Contadores ---
+
+    def incr(self, name, amount=1):
+        with self.transaction() as db:
+            db.execute("INSERT INTO counters (name, value) VALUES (?, ?) "
+                       "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, amount))
+
+    def counters(self, prefix=""):
+        rows = self.query("SELECT name, value FROM counters WHERE name LIKE ?", (prefix + "%",))
+        return {name[len(prefix):]: value for name, value in rows}
@@ -1,12 +1,36 @@
 #!/usr/bin/env python3
 import argparse
+import fcntl
+import hashlib
 import json
 import os
+import re
+import shutil
 import sys
 import tempfile
+import threading
+import time
 import traceback
 import uuid
 
+import state
+
+CACHE_DIR = os.getenv("TOSPEECH_CACHE_DIR", "/tmp/tospeech/cache")
+CACHE_MAX_BYTES = int(os.getenv("TOSPEECH_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))  # 200 MB
+CACHE_MAX_ENTRIES = int(os.getenv("TOSPEECH_CACHE_MAX_ENTRIES", "1000"))
+# Textos más largos que esto se sintetizan por partes en paralelo (0 = nunca)
+CHUNK_CHARS = int(os.getenv("TOSPEECH_CHUNK_CHARS", "400"))
+MAX_CONCURRENCY = int(os.getenv("TOSPEECH_MAX_CONCURRENCY", "4"))
+HEALTH_FILE = os.getenv("TOSPEECH_HEALTH_FILE", "/tmp/tospeech/engine_health.json")
+# Fallos seguidos que abren el circuito de un engine, y cuánto tiempo queda abierto
+BREAKER_FAILURES = int(os.getenv("TOSPEECH_BREAKER_FAILURES", "2"))
+BREAKER_COOLDOWN = float(os.getenv("TOSPEECH_BREAKER_COOLDOWN", "300"))
+# Un engine con p50 por encima de esto pasa detrás de los más rápidos
+SLOW_SECONDS = float(os.getenv("TOSPEECH_SLOW_SECONDS", "3"))
+# Las muestras más viejas que esto (segundos) ya no cuentan para ordenar los engines
+SAMPLE_MAX_AGE = float(os.getenv("TOSPEECH_SAMPLE_MAX_AGE", "3600"))
+DEADLINE = float(os.getenv("TOSPEECH_DEADLINE", "0"))  # 0 = sin límite
+
 def ensure_output_directory():
     output_dir = "/tmp/tospeech"
     if not os.path.exists(output_dir):
@@ -16,6 +40,26 @@ def ensure_output_directory():
 def generate_unique_filename(extension):
     return f"{uuid.uuid4()}.{extension}"
 
+def split_into_chunks(text, max_chars):
+    """
+    Divide el texto en fragmentos de hasta max_chars caracteres, cortando por
+    oraciones; una oración más larga que el límite se corta por palabras.
+    """
+    sentences = [s for s in re.split(r"(?<=[.!?…;:])\s+|\n+", text.strip()) if s.strip()]
+    chunks = []
+    current = ""
+    for sentence in sentences:
+        words = sentence.split() if len(sentence) > max_chars else [sentence]
+        for piece in words:
+            if current and len(current) + len(piece) + 1 > max_chars:
+                chunks.append(current)
+                current = piece
+            else:
+                current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks or [text]
+
 def speak_with_edge_tts(text, args):
     import asyncio
     import edge_tts
@@ -27,12 +71,55 @@ def speak_with_edge_tts(text, args):
     rate = args.get("rate", "+0%")
     pitch = args.get("pitch", "+0%")
     output_dir = ensure_output_directory()
+    chunk_chars = int(args.get("chunk_chars", CHUNK_CHARS))
+    max_concurrency = int(args.get("max_concurrency", MAX_CONCURRENCY))
     output = os.path.join(output_dir, generate_unique_filename("mp3"))
 
-    async def synthesize():
-        communicate = edge_tts.Communicate(text=text, voice=voice, rate=rate)
-        await communicate.save(output)
-    asyncio.run(synthesize())
+    # Tiempo que le queda a synthesize() para este engine (None = sin límite)
+    timeout = args.get("timeout")
+
+    chunks = split_into_chunks(text, chunk_chars) if chunk_chars > 0 and len(text) > chunk_chars else [text]
+    if len(chunks) == 1:
+        async def synthesize():
+            communicate = edge_tts.Communicate(text=text, voice=voice, rate=rate)
+            await asyncio.wait_for(communicate.save(output), timeout)
+        try:
+            asyncio.run(synthesize())
+        except BaseException:
+            if os.path.exists(output):
+                os.remove(output)
+            raise
+        return output
+
+    # Texto largo: sintetizamos cada fragmento en paralelo (con un tope de
+    # peticiones simultáneas) y después los unimos en orden.
+    parts = [f"{output}.{i}.part" for i in range(len(chunks))]
+
+    async def synthesize_chunk(chunk, path, semaphore):
+        async with semaphore:
+            communicate = edge_tts.Communicate(text=chunk, voice=voice, rate=rate)
+            await communicate.save(path)
+
+    async def synthesize_all():
+        semaphore = asyncio.Semaphore(max_concurrency)
+        await asyncio.wait_for(
+            asyncio.gather(*(synthesize_chunk(c, p, semaphore) for c, p in zip(chunks, parts))), timeout)
+
+    try:
+        asyncio.run(synthesize_all())
+        # edge-tts genera MP3 sin cabeceras ID3: los frames se pueden concatenar tal cual
+        with open(output, "wb") as out:
+            for path in parts:
+                with open(path, "rb") as part:
+                    shutil.copyfileobj(part, out)
+    except BaseException:
+        if os.path.exists(output):
+            os.remove(output)
+        raise
+    finally:
+        for path in parts:
+            if os.path.exists(path):
+                os.remove(path)
     return output
 
 def speak_with_gtts(text, args):
@@ -43,8 +130,14 @@ def speak_with_gtts(text, args):
     output_dir = ensure_output_directory()
     output = os.path.join(output_dir, generate_unique_filename("mp3"))
 
-    tts = gTTS(text=text, lang=lang, slow=slow)
-    tts.save(output)
+    # timeout: el de cada petición HTTP de gTTS (gtts >= 2.3)
+    tts = gTTS(text=text, lang=lang, slow=slow, timeout=args.get("timeout"))
+    try:
+        tts.save(output)
+    except BaseException:
+        if os.path.exists(output):
+            os.remove(output)
+        raise
     return output
 
 def speak_with_pyttsx3(text, args):
@@ -70,9 +163,214 @@ def speak_with_espeak(text, args):
     speed = str(args.get("speed", 150))
     output_dir = ensure_output_directory()
     output = os.path.join(output_dir, generate_unique_filename("wav"))
-    os.system(f'espeak "{text}" -v {voice} -p {pitch} -s {speed} --stdout > "{output}"')
+    status = os.system(f'espeak "{text}" -v {voice} -p {pitch} -s {speed} --stdout > "{output}"')
+    if status != 0 or os.path.getsize(output) == 0:
+        # Sin el binario la shell igual crea el archivo (vacío): no cuenta como éxito
+        os.remove(output)
+        raise RuntimeError(f"espeak falló (estado {status})")
     return output
 
+class AudioCache:
+    """
+    Cache de audios sintetizados, direccionado por contenido: la clave es un
+    hash de (texto, engine, voz, rate, pitch y demás parámetros del engine).
+    El índice (tamaño y último uso de cada audio) y los contadores viven en la
+    base de estado compartida (state.py), así que elegir qué expulsar es una
+    consulta y no un recorrido del directorio.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, max_entries=CACHE_MAX_ENTRIES, store=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.store = store or state.StateStore()
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(text, engine, args):
+        data = {
+            "text": text,
+            "engine": engine,
+            "voice": args.get("voice"),
+            "rate": args.get("rate"),
+            "pitch": args.get("pitch"),
+            "args": args,
+        }
+        return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        for ext in ("mp3", "wav"):
+            name = f"{key}.{ext}"
+            path = os.path.join(self.directory, name)
+            if not os.path.exists(path):
+                continue
+            # marca como usado recientemente (y agrega al índice audios que no estaban)
+            if not self.store.tts_touch(name):
+                self.store.tts_put(name, os.path.getsize(path))
+            return path
+        return None
+
+    def put(self, key, path):
+        """Mueve el audio generado al cache y devuelve su nueva ruta."""
+        ext = os.path.splitext(path)[1] or ".mp3"
+        cached = os.path.join(self.directory, key + ext)
+        try:
+            os.replace(path, cached)
+        except OSError:
+            # Distinto filesystem: copiamos a un temporal y renombramos
+            tmp = os.path.join(self.directory, f".{uuid.uuid4()}{ext}")
+            shutil.move(path, tmp)
+            os.replace(tmp, cached)
+        self.store.tts_put(key + ext, os.path.getsize(cached))
+        self.evict(keep=cached)
+        return cached
+
+    def evict(self, keep=None):
+        count, total = self.store.tts_usage()
+        if total <= self.max_bytes and count <= self.max_entries:
+            return
+        evicted = []
+        for name, size in self.store.tts_oldest(count):
+            if total <= self.max_bytes and count <= self.max_entries:
+                break
+            path = os.path.join(self.directory, name)
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            evicted.append(name)
+            total -= size
+            count -= 1
+        self.store.tts_forget(evicted)
+        if evicted:
+            self.count("evictions", len(evicted))
+
+    def count(self, counter, amount=1):
+        self.store.incr(f"tts_cache.{counter}", amount)
+
+    def stats(self):
+        stats = {"hits": 0, "misses": 0, "evictions": 0}
+        stats.update(self.store.counters("tts_cache."))
+        stats["entries"], stats["bytes"] = self.store.tts_usage()
+        return stats
+
+class EngineHealth:
+    """
+    Salud y latencia de cada engine, persistida entre ejecuciones en un JSON.
+
+    Guarda las últimas muestras (ok/fallo y duración) y los fallos seguidos;
+    con BREAKER_FAILURES fallos seguidos el circuito se abre y el engine se
+    saltea durante BREAKER_COOLDOWN segundos. Pasado ese tiempo se prueba una
+    vez en su lugar de siempre (medio abierto) y, si anda, empieza de cero.
+    Las muestras de más de SAMPLE_MAX_AGE segundos se olvidan, así un engine
+    relegado por fallos viejos vuelve a subir aunque no se lo pruebe.
+    """
+    WINDOW = 20
+
+    def __init__(self, path=HEALTH_FILE):
+        self.path = path
+        self.data = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _update(self, engine, ok, latency):
+        # Releemos bajo lock para no pisar lo que hayan escrito otras ejecuciones
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                data = json.loads(f.read() or "{}")
+            except ValueError:
+                data = {}
+            stats = data.setdefault(engine, {"samples": [], "consecutive_failures": 0, "last_failure": 0})
+            stats["samples"] = (stats["samples"] + [[time.time(), ok, round(latency, 3)]])[-self.WINDOW:]
+            if ok:
+                if stats["consecutive_failures"] >= BREAKER_FAILURES:
+                    # Se recuperó tras abrirse el circuito: los fallos anteriores ya no lo describen
+                    stats["samples"] = stats["samples"][-1:]
+                stats["consecutive_failures"] = 0
+            else:
+                stats["consecutive_failures"] += 1
+                stats["last_failure"] = time.time()
+            f.seek(0)
+            f.truncate()
+            json.dump(data, f)
+        self.data = data
+
+    def record_success(self, engine, latency):
+        self._update(engine, True, latency)
+
+    def record_failure(self, engine, latency):
+        self._update(engine, False, latency)
+
+    def is_open(self, engine):
+        stats = self.data.get(engine)
+        if not stats or stats["consecutive_failures"] < BREAKER_FAILURES:
+            return False
+        return time.time() - stats["last_failure"] < BREAKER_COOLDOWN
+
+    def half_open(self, engine):
+        """Circuito abierto por fallos pero con el enfriamiento cumplido: toca probarlo."""
+        stats = self.data.get(engine)
+        return bool(stats) and stats["consecutive_failures"] >= BREAKER_FAILURES and not self.is_open(engine)
+
+    def _samples(self, engine):
+        oldest = time.time() - SAMPLE_MAX_AGE
+        return [sample for sample in self.data.get(engine, {}).get("samples", []) if sample[0] >= oldest]
+
+    def success_rate(self, engine):
+        samples = self._samples(engine)
+        if not samples:
+            return 1.0
+        return sum(1 for _, ok, _ in samples if ok) / len(samples)
+
+    def p50(self, engine):
+        latencies = sorted(lat for _, ok, lat in self._samples(engine) if ok)
+        if not latencies:
+            return 0.0
+        return latencies[len(latencies) // 2]
+
+    def order(self, engines):
+        """
+        Ordena los engines con el circuito cerrado por tasa de éxito reciente y
+        dejando atrás los lentos (p50 > SLOW_SECONDS); a igualdad se respeta el
+        orden de ENGINES, que refleja la calidad de la voz. Los engines con el
+        circuito abierto sólo se devuelven si no queda ninguno cerrado; los
+        medio abiertos se prueban en su lugar de ENGINES, como si no tuvieran
+        historia.
+        """
+        engines = list(engines)
+        closed = [e for e in engines if not self.is_open(e)]
+        candidates = closed or engines
+
+        def key(e):
+            if self.half_open(e):
+                return (-1.0, False, engines.index(e))
+            return (-round(self.success_rate(e), 1), self.p50(e) > SLOW_SECONDS, engines.index(e))
+
+        return sorted(candidates, key=key)
+
+    def summary(self):
+        return {
+            engine: {
+                "success_rate": round(self.success_rate(engine), 2),
+                "p50": self.p50(engine),
+                "open": self.is_open(engine),
+            }
+            for engine in self.data
+        }
+
 ENGINES = {
     "edge-tts": speak_with_edge_tts,
     "gtts": speak_with_gtts,
@@ -80,6 +378,92 @@ ENGINES = {
     "espeak": speak_with_espeak,
 }
 
+# Engines habilitados, en orden de preferencia (por defecto todos)
+ENABLED_ENGINES = [name.strip() for name in os.getenv("TOSPEECH_ENGINES", ",".join(ENGINES)).split(",")
+                   if name.strip() in ENGINES]
+
+def run_with_deadline(func, timeout, *args):
+    """
+    Ejecuta func en un hilo y espera a lo sumo timeout segundos (None = sin
+    límite). Si se abandona y el hilo termina después, se borra el archivo
+    que devolvió: nadie lo va a usar.
+    """
+    result = {}
+    lock = threading.Lock()
+
+    def target():
+        try:
+            value = func(*args)
+        except Exception as e:
+            result["error"] = e
+            return
+        with lock:
+            if not result.get("abandoned"):
+                result["value"] = value
+                return
+        if isinstance(value, str) and os.path.exists(value):
+            os.remove(value)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    with lock:
+        if "value" not in result and "error" not in result:
+            result["abandoned"] = True
+            raise TimeoutError(f"superado el límite de {timeout:.1f}s")
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+def synthesize(text, engine_args=None, engine=None, deadline=DEADLINE, use_cache=True):
+    """
+    Sintetiza text y devuelve la ruta del audio, o None si ningún engine pudo.
+    Sin engine forzado, los engines se prueban en el orden que da EngineHealth
+    y, si hay deadline (segundos), se abandona el que no termine a tiempo.
+    """
+    engine_args = engine_args or {}
+    cache = AudioCache() if use_cache else None
+    health = EngineHealth()
+    engines_to_try = [engine] if engine else health.order(ENABLED_ENGINES)
+    start = time.monotonic()
+
+    if cache:
+        for engine_name in engines_to_try:
+            cached = cache.get(cache.key(text, engine_name, engine_args))
+            if cached:
+                cache.count("hits")
+                return cached
+        cache.count("misses")
+
+    for engine_name in engines_to_try:
+        engine_func = ENGINES.get(engine_name)
+        if not engine_func:
+            continue
+        remaining = None
+        if deadline:
+            remaining = deadline - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+        attempt_start = time.monotonic()
+        try:
+            # El engine recibe lo que queda del plazo para cortar él mismo sus peticiones
+            args = dict(engine_args, timeout=remaining) if remaining is not None else engine_args
+            outpath = run_with_deadline(engine_func, remaining, text, args)
+            if not os.path.getsize(outpath):
+                os.remove(outpath)
+                raise RuntimeError(f"{engine_name} generó un audio vacío")
+        except ImportError:
+            # Engine no instalado: se saltea sin tocar su salud (la comparten todos los procesos)
+            continue
+        except Exception:
+            health.record_failure(engine_name, time.monotonic() - attempt_start)
+            continue
+        health.record_success(engine_name, time.monotonic() - attempt_start)
+        if cache:
+            outpath = cache.put(cache.key(text, engine_name, engine_args), outpath)
+        return outpath
+    return None
+
 def main():
     parser = argparse.ArgumentParser(description="Síntesis de voz desde la línea de comandos.")
     parser.add_argument("--message", help="Texto a sintetizar", type=str)
@@ -87,8 +471,20 @@ def main():
     parser.add_argument("--engine", help="Forzar un engine específico", choices=list(ENGINES.keys()))
     parser.add_argument("--engine-args", help="Parámetros específicos para el engine (JSON)", type=str)
     parser.add_argument("--test-engines", help="Probar todos los engines y generar un archivo por cada uno", action="store_true")
+    parser.add_argument("--no-cache", help="No usar el cache de audios", action="store_true")
+    parser.add_argument("--cache-stats", help="Mostrar estadísticas del cache de audios", action="store_true")
+    parser.add_argument("--deadline", help="Tiempo máximo en segundos para obtener el audio", type=float, default=DEADLINE)
+    parser.add_argument("--engine-stats", help="Mostrar salud y latencia de los engines", action="store_true")
     args = parser.parse_args()
 
+    if args.cache_stats:
+        print(json.dumps(AudioCache().stats()))
+        return
+
+    if args.engine_stats:
+        print(json.dumps(EngineHealth().summary()))
+        return
+
     if not args.message and not args.test_engines:
         # print("Debes especificar un mensaje con --message o usar --test-engines.")
         sys.exit(1)
@@ -119,24 +515,13 @@ def main():
             print(outpath)
             return
 
-    engines_to_try = [args.engine] if args.engine else ENGINES.keys()
-    for engine_name in engines_to_try:
-        engine_func = ENGINES.get(engine_name)
-        if not engine_func:
-            continue
-        try:
-            # print(f"Usando engine: {engine_name}")
-            outpath = engine_func(args.message, engine_args)
-            # print(f"✅ Audio generado: {outpath}")
-            print(outpath)
-            return
-        except Exception as e:
-            pass
-            # print(f"❌ Falló con {engine_name}: {str(e)}")
-            continue
-
-    pass
-    # print("Ningún engine pudo sintetizar el mensaje.")
+    outpath = synthesize(args.message, engine_args, engine=args.engine,
+                         deadline=args.deadline, use_cache=not args.no_cache)
+    if outpath:
+        # print(f"✅ Audio generado: {outpath}")
+        print(outpath)
+    # else:
+    #     print("Ningún engine pudo sintetizar el mensaje.")
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,10 @@
-import whisper
 import sys
 import os
+import json
+import queue
+import socket
+import socketserver
+import threading
 import warnings
 
 MODELS = [
@@ -14,12 +18,21 @@ MODELS = [
     ("large-v3-turbo", "1550 MB", "Muy alta ++", "Multilingüe", "Más rápida, igual precisión"),
 ]
 
+DEFAULT_MODEL = "large-v3-turbo"
+DEFAULT_SOCKET = os.getenv("TRANSCRIBE_SOCKET", "/tmp/telegrambot/transcribe.sock")
+# Trabajos en espera como máximo en el servidor (los siguientes se rechazan)
+QUEUE_SIZE = int(os.getenv("TRANSCRIBE_QUEUE_SIZE", "16"))
+
 def print_help():
-    print("Uso: python transcribe.py <ruta_al_audio> [opciones]\n")
+    print("Uso: python transcribe.py <ruta_al_audio> [opciones]")
+    print("     python transcribe.py --serve [--socket <ruta>] [--model <nombre>]\n")
     print("Opciones:")
     print("  --plain               Muestra el texto sin formato")
     print("  --srt                 Muestra salida en formato .srt (subtítulos)")
     print("  --model <nombre>      Especifica el modelo Whisper a usar")
+    print("  --serve               Modo servidor: carga el modelo una vez y atiende")
+    print("                        trabajos por un socket Unix")
+    print(f"  --socket <ruta>       Socket del servidor (por defecto {DEFAULT_SOCKET})")
     print("  --help                Muestra esta ayuda\n")
     print("Modelos disponibles:\n")
     print(f"{'Modelo':<15}{'Tamaño':<10}{'Precisión':<15}{'Idioma':<15}{'Uso recomendado'}")
@@ -28,36 +41,19 @@ def print_help():
         print(f"{name:<15}{size:<10}{prec:<15}{lang:<15}{use}")
     print()
 
-def main():
-    if len(sys.argv) < 2 or "--help" in sys.argv:
-        print_help()
-        sys.exit(0)
-
-    # argumentos
-    audio_path = sys.argv[1]
-    mode = "--plain" if "--plain" in sys.argv else "--srt" if "--srt" in sys.argv else "default"
-    model_name = "large-v3-turbo"
-
-    if "--model" in sys.argv:
-        try:
-            model_name = sys.argv[sys.argv.index("--model") + 1]
-        except IndexError:
-            print("Error: falta el nombre del modelo después de --model.")
-            sys.exit(1)
-
-    if not os.path.exists(audio_path):
-        print(f"Error: el archivo '{audio_path}' no existe.")
-        sys.exit(1)
+def load_model(model_name):
+    import whisper
 
     # advertencias de FP16
     warnings.filterwarnings("ignore", message="FP16 is not supported on CPU; using FP32 instead")
+    return whisper.load_model(model_name)
 
-    print(f"Cargando modelo '{model_name}'...")
-    model = whisper.load_model(model_name)
-    result = model.transcribe(audio_path)
+def format_result(result, mode):
+    """Devuelve la transcripción como texto en el formato pedido (--plain, --srt o default)."""
+    lines = []
 
     if mode == "--plain":
-        print(result["text"])
+        lines.append(result["text"])
 
     elif mode == "--srt":
         # parámetros de agrupación
@@ -116,19 +112,146 @@ def main():
         if current["start"] is not None:
             merged.append(current)
 
-        # imprimir subtítulos combinados
+        # subtítulos combinados
         for i, seg in enumerate(merged, start=1):
-            print(f"{i}")
-            print(f"{fmt(seg['start'])} --> {fmt(seg['end'])}")
-            print(f"{split_text(seg['text'].strip(), max_chars_per_line)}\n")
+            lines.append(f"{i}")
+            lines.append(f"{fmt(seg['start'])} --> {fmt(seg['end'])}")
+            lines.append(f"{split_text(seg['text'].strip(), max_chars_per_line)}\n")
 
     else:
         for segment in result["segments"]:
             start = segment["start"]
             end = segment["end"]
             text = segment["text"].strip()
-            print(f"[{start:6.2f} → {end:6.2f}] {text}")
+            lines.append(f"[{start:6.2f} → {end:6.2f}] {text}")
+
+    return "\n".join(lines)
+
+
+class TranscriptionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Servidor residente: el modelo se carga una sola vez y los trabajos se
+    transcriben de a uno (en orden de llegada) desde una cola acotada.
+
+    Protocolo: una línea JSON por conexión, {"audio": <ruta>, "mode": "--plain"},
+    y como respuesta otra línea JSON, {"ok": true, "output": <texto>} o
+    {"ok": false, "error": <mensaje>}.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, model, queue_size=QUEUE_SIZE):
+        self.model = model
+        self.jobs = queue.Queue(maxsize=queue_size)
+        super().__init__(socket_path, TranscriptionRequestHandler)
+        threading.Thread(target=self._worker, name="transcribe-worker", daemon=True).start()
+
+    def _worker(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                result = self.model.transcribe(job["audio"])
+                job["reply"] = {"ok": True, "output": format_result(result, job["mode"])}
+            except Exception as e:
+                job["reply"] = {"ok": False, "error": str(e)}
+            finally:
+                job["done"].set()
+
+
+class TranscriptionRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+            audio_path = request["audio"]
+            if not os.path.exists(audio_path):
+                reply = {"ok": False, "error": f"el archivo '{audio_path}' no existe."}
+            else:
+                job = {"audio": audio_path, "mode": request.get("mode", "default"), "done": threading.Event()}
+                try:
+                    self.server.jobs.put_nowait(job)
+                except queue.Full:
+                    reply = {"ok": False, "error": "cola de transcripción llena."}
+                else:
+                    job["done"].wait()
+                    reply = job["reply"]
+        except Exception as e:
+            reply = {"ok": False, "error": str(e)}
+        self.wfile.write((json.dumps(reply, ensure_ascii=False) + "\n").encode("utf-8"))
+
+
+def serve(model_name=DEFAULT_MODEL, socket_path=DEFAULT_SOCKET):
+    socket_dir = os.path.dirname(socket_path)
+    if socket_dir and not os.path.exists(socket_dir):
+        os.makedirs(socket_dir)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    print(f"Cargando modelo '{model_name}'...", flush=True)
+    model = load_model(model_name)
+    with TranscriptionServer(socket_path, model) as server:
+        print(f"Escuchando en {socket_path}", flush=True)
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+def transcribe_remote(audio_path, mode="default", socket_path=DEFAULT_SOCKET, timeout=600):
+    """
+    Pide una transcripción al servidor residente. Lanza FileNotFoundError o
+    ConnectionRefusedError si el servidor no está corriendo y RuntimeError si la transcripción falla.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        request = {"audio": os.path.abspath(audio_path), "mode": mode}
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise RuntimeError("El servidor de transcripción cerró la conexión.")
+    reply = json.loads(line.decode("utf-8"))
+    if not reply.get("ok"):
+        raise RuntimeError(reply.get("error", "error desconocido"))
+    return reply["output"]
+
+
+def main():
+    if len(sys.argv) < 2 or "--help" in sys.argv:
+        print_help()
+        sys.exit(0)
+
+    # argumentos
+    mode = "--plain" if "--plain" in sys.argv else "--srt" if "--srt" in sys.argv else "default"
+    model_name = DEFAULT_MODEL
+    socket_path = DEFAULT_SOCKET
+
+    if "--model" in sys.argv:
+        try:
+            model_name = sys.argv[sys.argv.index("--model") + 1]
+        except IndexError:
+            print("Error: falta el nombre del modelo después de --model.")
+            sys.exit(1)
+
+    if "--socket" in sys.argv:
+        try:
+            socket_path = sys.argv[sys.argv.index("--socket") + 1]
+        except IndexError:
+            print("Error: falta la ruta después de --socket.")
+            sys.exit(1)
+
+    if "--serve" in sys.argv:
+        serve(model_name, socket_path)
+        return
+
+    audio_path = sys.argv[1]
+    if not os.path.exists(audio_path):
+        print(f"Error: el archivo '{audio_path}' no existe.")
+        sys.exit(1)
+
+    print(f"Cargando modelo '{model_name}'...")
+    model = load_model(model_name)
+    result = model.transcribe(audio_path)
+    print(format_result(result, mode))
 
 if __name__ == "__main__":
     main()
-
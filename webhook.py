@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Modo webhook: Telegram (o el proxy inverso que tengamos delante) hace POST
+de cada update a un servidor HTTP local, en lugar de que el bot lo pida con
+getUpdates. Los updates entran por bot.process_new_updates, así que llegan a
+los mismos handlers (y al dispatcher por chat) que en modo polling.
+
+Cada POST debe traer la cabecera X-Telegram-Bot-Api-Secret-Token con el
+secreto configurado en setWebhook; si no, se responde 403.
+"""
+import hmac
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Un update de texto pesa unos cientos de bytes; esto sobra
+MAX_BODY = 1024 * 1024
+
+# Servidor en marcha (para poder detenerlo con stop())
+_server = None
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, bot, address, path, secret_token):
+        super().__init__(address, WebhookRequestHandler)
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.debug(f"Webhook {self.address_string()}: {format % args}")
+
+    def _reply(self, status, body=b""):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # Para el health check del proxy
+        self._reply(200 if self.path == self.server.path else 404, b"ok")
+
+    def do_POST(self):
+        server = self.server
+        if self.path != server.path:
+            self._reply(404)
+            return
+        token = self.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode("utf-8"), server.secret_token.encode("utf-8")):
+            logging.warning(f"Webhook: secret token inválido desde {self.address_string()}")
+            self._reply(403)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY:
+            self._reply(413 if length > MAX_BODY else 400)
+            return
+        try:
+            update = types.Update.de_json(json.loads(self.rfile.read(length)))
+        except ValueError as e:
+            logging.warning(f"Webhook: update inválido: {str(e)}")
+            self._reply(400)
+            return
+        # Sólo se encola en el dispatcher: respondemos enseguida para que
+        # Telegram no espere a que termine el handler
+        server.bot.process_new_updates([update])
+        self._reply(200)
+
+
+def serve(bot, listen, port, path, secret_token, public_url=None):
+    """
+    Atiende el webhook hasta que se llame a stop(). Con public_url
+    (la URL por la que Telegram llega al bot, p.ej. la del proxy) registra
+    el webhook con setWebhook; si no, se asume configurado por fuera.
+    """
+    global _server
+    if not secret_token:
+        raise ValueError("El modo webhook necesita un secret token.")
+    server = _server = WebhookServer(bot, (listen, port), path, secret_token)
+    if public_url:
+        bot.set_webhook(url=public_url.rstrip("/") + path, secret_token=secret_token)
+    logging.info(f"Listening for webhook updates on {listen}:{server.server_address[1]}{path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        _server = None
+
+
+def stop():
+    """Hace volver a serve(). Debe llamarse desde otro hilo (p.ej. un handler)."""
+    if _server is not None:
+        _server.shutdown()